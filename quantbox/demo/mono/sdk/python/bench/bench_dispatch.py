@@ -0,0 +1,56 @@
+##
+# @file bench_dispatch.py
+# per-type cost of objects.ptr_to_object: type id table against if/elif chain over ObjectType, which
+# ptr_to_object walked before the table
+# usage: XROAD_ROOT_DIR=<root> python3 bench/bench_dispatch.py [count]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import xroad.lib as lib
+import xroad.objects as objects
+
+
+##
+# dispatch as ptr_to_object did it before: ObjectType is built and compared with types in declaration order
+def dispatch_chain(ptr, chain):
+    obj_type = objects.ObjectType(lib.node().xroad_object_get_type(ptr))
+    for t, cls, owns_ptr in chain:
+        if obj_type == t:
+            return cls(ptr, False) if owns_ptr else cls(ptr)
+    raise TypeError("unknown object type")
+
+
+def measure(fn, ptr, count):
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        fn(ptr)
+    return (time.perf_counter_ns() - start) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    chain = [(t, ) + objects._OBJECT_CLASSES[t.value] for t in objects.ObjectType if t.value in objects._OBJECT_CLASSES]
+    print("{0:<28}{1:>12}{2:>12}{3:>10}".format("object type", "chain, ns", "table, ns", "speedup"))
+    total_chain = total_table = 0
+    keep = []
+    for t, _, _ in chain:
+        obj = objects.create_object(t)
+        keep.append(obj)
+        ptr = obj.ptr
+        chained = measure(lambda p: dispatch_chain(p, chain), ptr, count)
+        table = measure(objects.ptr_to_object, ptr, count)
+        total_chain += chained
+        total_table += table
+        print("{0:<28}{1:>12.1f}{2:>12.1f}{3:>10.2f}".format(t.name, chained, table, chained / table))
+    print("{0:<28}{1:>12.1f}{2:>12.1f}{3:>10.2f}".format("mean", total_chain / len(chain), total_table / len(chain),
+                                                       total_chain / total_table))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:et:sts=4:sw=4
@@ -0,0 +1,75 @@
+##
+# @file bench_export.py
+# per-object cost of exporting orders: obj.to_dict() of each wrapper against objects.to_dict_many,
+# objects.to_records and objects.to_numpy (if numpy is installed) over raw pointers
+# usage: XROAD_ROOT_DIR=<root> python3 bench/bench_export.py [count]
+#        XROAD_ROOT_DIR=<root> python3 bench/bench_export.py --cache <node name>
+#        the first form exports count of created orders with all scalar fields set, the second one exports
+#        orders of node cache through NodeCursor, node is started out of system
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import xroad.objects as objects
+import xroad.xtypes as xtypes
+from xroad.node import Node
+
+
+##
+# create orders with all scalar fields set
+# @return list of wrappers, they own objects
+def create_orders(count):
+    fields = objects.get_object_schema(objects.ObjectType.order)["fields"]
+    res = []
+    for n in range(count):
+        obj = objects.create_object(objects.ObjectType.order)
+        for field in fields:
+            if field["type"] == "enum":
+                setattr(obj, field["name"], list(getattr(xtypes, field["enum_name"]))[0])
+            elif field["type"] == "string":
+                setattr(obj, field["name"], "o{0}".format(n)[:field["size"] - 1])
+            elif field["type"] == "double":
+                setattr(obj, field["name"], n + 0.5)
+            elif field["type"] not in ("object_ref", "binary"):
+                setattr(obj, field["name"], n % 100)
+        res.append(obj)
+    return res
+
+
+def measure(name, fn, count):
+    start = time.perf_counter_ns()
+    fn()
+    print("{0:<16}{1:>12.1f}".format(name, (time.perf_counter_ns() - start) / count))
+
+
+def main():
+    node = None
+    if len(sys.argv) > 2 and sys.argv[1] == "--cache":
+        node = Node(sys.argv[2], out_of_system=True)
+        with node.create_cursor(objects.ObjectType.order) as cursor:
+            ptrs = list(cursor.pointers)
+        if not ptrs:
+            raise RuntimeError("no orders in cache")
+    else:
+        orders = create_orders(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+        ptrs = [o.ptr for o in orders]
+    count = len(ptrs)
+    wrap = objects.object_factory(objects.ObjectType.order)
+    print("{0} orders, ns per object".format(count))
+    measure("to_dict", lambda: [wrap(p).to_dict() for p in ptrs], count)
+    measure("to_dict_many", lambda: objects.to_dict_many(ptrs), count)
+    measure("to_records", lambda: objects.to_records(ptrs), count)
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return
+    measure("to_numpy", lambda: objects.to_numpy(ptrs, objects.ObjectType.order, count=count), count)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:et:sts=4:sw=4
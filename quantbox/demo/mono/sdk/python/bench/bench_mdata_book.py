@@ -0,0 +1,113 @@
+##
+# @file bench_mdata_book.py
+# cost of FullBook operations with "arr" and "map" backends of mdata_book library on a recorded order log:
+# order_log objects of node cache, node is started out of system. requires numpy
+# usage: XROAD_ROOT_DIR=<root> python3 bench/bench_mdata_book.py <node name> [instr id]
+#        order log of instrument with most records is taken if instr id is not given
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import xroad.instrdb as instrdb
+import xroad.objects as objects
+from xroad.mdata import FullBook, BookAction
+from xroad.node import Node
+from xroad.xtypes import Side
+
+_fields = ["orderno", "instr", "side", "price", "leaves_qty", "tran_time"]
+
+
+##
+# reads order log of node cache
+# @return numpy structured array of _fields in cache order, rows with unset fields are dropped
+def read_order_log(node_name):
+    import numpy
+    node = Node(node_name, out_of_system=True)
+    count = node.get_object_count(objects.ObjectType.order_log)
+    with node.create_cursor(objects.ObjectType.order_log) as cursor:
+        rows = objects.to_numpy(cursor.pointers, objects.ObjectType.order_log, _fields, count)
+    complete = numpy.ones(len(rows), bool)
+    for name in _fields:
+        complete &= ~numpy.ma.getmaskarray(rows[name])
+    return rows.data[complete]
+
+
+##
+# converts order log rows of instrument into order updates: first row of order adds it,
+# row with zero leaves qty deletes it, other rows set its qty to leaves qty
+# @return columns (actions, order_ids, prices, qtys, sides, ts)
+def to_order_updates(rows):
+    cols = ([], [], [], [], [], [])
+    live = set()
+    for orderno, _, side, price, leaves_qty, tran_time in rows.tolist():
+        if side not in (Side.buy, Side.sell):
+            continue
+        if leaves_qty == 0:
+            if orderno not in live:
+                continue
+            live.discard(orderno)
+            action = BookAction.order_delete
+        elif orderno in live:
+            action = BookAction.order_update
+        else:
+            live.add(orderno)
+            action = BookAction.order_add
+        for col, v in zip(cols, (int(action), orderno, price, leaves_qty, side, tran_time)):
+            col.append(v)
+    return cols
+
+
+def measure(fn, repeat):
+    start = time.perf_counter_ns()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter_ns() - start) / repeat
+
+
+def bench(backend, instr, order_updates, reads):
+    res = {}
+    book = FullBook(instr, backend)
+    start = time.perf_counter_ns()
+    book.order_update_many(*order_updates)
+    res["order_update"] = (time.perf_counter_ns() - start) / len(order_updates[0])
+    res["levels"] = measure(lambda: book.levels(Side.buy, 20), reads)
+    res["as_book"] = measure(book.as_book, reads)
+    res["as_quote"] = measure(book.as_quote, reads)
+    return res
+
+
+def main():
+    if len(sys.argv) < 2:
+        raise RuntimeError("usage: bench_mdata_book.py <node name> [instr id]")
+    import numpy
+    rows = read_order_log(sys.argv[1])
+    if not len(rows):
+        raise RuntimeError("no order log in cache")
+    if len(sys.argv) > 2:
+        instr_id = int(sys.argv[2])
+    else:
+        ids, counts = numpy.unique(rows["instr"], return_counts=True)
+        instr_id = int(ids[counts.argmax()])
+    order_updates = to_order_updates(rows[rows["instr"] == instr_id])
+    if not order_updates[0]:
+        raise RuntimeError("no order log of instrument {0}".format(instr_id))
+    instr = instrdb.InstrDB().get_by_id(instr_id)
+    if instr is None:
+        raise RuntimeError("unknown instrument {0}".format(instr_id))
+    count = len(order_updates[0])
+    reads = max(1, count // 10)
+    results = {backend: bench(backend, instr, order_updates, reads) for backend in ("arr", "map")}
+    print("instrument {0}, {1} order updates, {2} reads, ns per call".format(instr_id, count, reads))
+    print("{0:<14}{1:>12}{2:>12}{3:>10}".format("operation", "arr", "map", "map/arr"))
+    for op in ("order_update", "levels", "as_book", "as_quote"):
+        arr, map_ = results["arr"][op], results["map"][op]
+        print("{0:<14}{1:>12.1f}{2:>12.1f}{3:>10.2f}".format(op, arr, map_, map_ / arr))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:et:sts=4:sw=4
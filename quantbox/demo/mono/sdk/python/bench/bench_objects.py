@@ -0,0 +1,61 @@
+##
+# @file bench_objects.py
+# per-field cost of object accessors: prototypes set on each call (as generated accessors did before
+# bind_prototypes) against prototypes bound once at lib.init()
+# usage: XROAD_ROOT_DIR=<root> python3 bench/bench_objects.py [count]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import xroad.lib as lib
+import xroad.objects as objects
+
+
+##
+# field read as generated accessors did it before: prototypes of is_set and get are set on each call
+def read_unbound(ptr, is_set_name, get_name):
+    prototypes = objects._PROTOTYPES
+    getattr(lib.node(), is_set_name).argtypes = prototypes[is_set_name][0]
+    getattr(lib.node(), is_set_name).restype = prototypes[is_set_name][1]
+    if getattr(lib.node(), is_set_name)(ptr):
+        getattr(lib.node(), get_name).argtypes = prototypes[get_name][0]
+        getattr(lib.node(), get_name).restype = prototypes[get_name][1]
+        return getattr(lib.node(), get_name)(ptr)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lib.init()
+    obj = objects.create_object(objects.ObjectType.order)
+    fields = [f["name"] for f in objects.get_object_schema(objects.ObjectType.order)["fields"]
+              if f["type"] in ("int8", "int16", "int32", "int64", "uint8", "uint16", "uint32", "uint64", "double")]
+    for field in fields:
+        setattr(obj, field, 1)
+    ptr = obj.ptr
+    names = [("xroad_order_{0}_is_set".format(f), "xroad_order_get_{0}".format(f)) for f in fields]
+
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        for is_set_name, get_name in names:
+            read_unbound(ptr, is_set_name, get_name)
+    unbound = (time.perf_counter_ns() - start) / (count * len(fields))
+
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        for field in fields:
+            getattr(obj, field)
+    bound = (time.perf_counter_ns() - start) / (count * len(fields))
+
+    print("order, {0} numeric fields, {1} reads each".format(len(fields), count))
+    print("prototypes set per call: {0:8.1f} ns/field".format(unbound))
+    print("prototypes bound once:   {0:8.1f} ns/field".format(bound))
+    print("speedup:                 {0:8.2f}x".format(unbound / bound))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:et:sts=4:sw=4
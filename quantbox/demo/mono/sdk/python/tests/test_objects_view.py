@@ -0,0 +1,90 @@
+##
+# @file test_objects_view.py
+# round trip of object fields: written through the properties, read back through objects.view()
+# usage: XROAD_ROOT_DIR=<root> python3 -m unittest discover -s tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_skip = None
+if "XROAD_ROOT_DIR" not in os.environ:
+    _skip = "XROAD_ROOT_DIR is not set"
+else:
+    try:
+        import xroad.objects as objects  # xroad package does lib.init()
+        import xroad.xtypes as xtypes
+    except OSError as e:
+        _skip = "SDK libraries can't be loaded: {0}".format(e)
+
+
+##
+# sample value of schema field, None for fields which are not round tripped (object references)
+def _sample(field):
+    if field["type"] == "enum":
+        return list(getattr(xtypes, field["enum_name"]))[-1]
+    elif field["type"] == "string":
+        return "s_{0}".format(field["name"])[:field["size"] - 1]
+    elif field["type"] == "binary":
+        return bytes(range(1, 9))
+    elif field["type"] == "double":
+        return 1.5
+    elif field["type"] == "object_ref":
+        return None
+    return 7
+
+
+@unittest.skipIf(_skip, _skip)
+class TestObjectView(unittest.TestCase):
+
+    def test_round_trip(self):
+        for obj_type in objects.ObjectType:
+            fields = objects.get_object_schema(obj_type)["fields"]
+            with self.subTest(obj_type=obj_type.name):
+                obj = objects.create_object(obj_type)
+                written = {}
+                for field in fields:
+                    value = _sample(field)
+                    if value is not None:
+                        setattr(obj, field["name"], value)
+                        written[field["name"]] = value
+                v = objects.view(obj)
+                self.assertEqual(v.object_type, obj_type)
+                self.assertEqual(v.fields(), written)
+                for field in fields:
+                    name = field["name"]
+                    self.assertEqual(v.is_set(name), name in written)
+                    self.assertEqual(getattr(v, name), getattr(obj, name) if name in written else None)
+                    if name in written:
+                        self.assertEqual(getattr(v, name), written[name])
+
+    def test_unset_fields(self):
+        for obj_type in objects.ObjectType:
+            with self.subTest(obj_type=obj_type.name):
+                v = objects.view(objects.create_object(obj_type))
+                self.assertEqual(v.fields(), {})
+                for field in objects.get_object_schema(obj_type)["fields"]:
+                    self.assertFalse(v.is_set(field["name"]))
+                    self.assertIsNone(getattr(v, field["name"]))
+
+    def test_reset_field(self):
+        obj = objects.create_object(objects.ObjectType.order)
+        obj.qty = 10
+        self.assertEqual(objects.view(obj).qty, 10)
+        obj.qty = None
+        v = objects.view(obj)
+        self.assertFalse(v.is_set("qty"))
+        self.assertIsNone(v.qty)
+
+    def test_unknown_field(self):
+        v = objects.view(objects.create_object(objects.ObjectType.order))
+        with self.assertRaises(AttributeError):
+            v.no_such_field
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim:et:sts=4:sw=4
@@ -1,5 +1,5 @@
 __all__ = ["common", "registry", "xtypes", "objects", "config", "logger", "node", "instrdb", "lib", "mdata_ctypes",
-"mdata", "order", "ui", "robot", "process", "log"]
+"mdata", "order", "ui", "robot", "process", "log", "index", "journal", "replay", "ordersim"]
 
 import sys
 from .lib import init
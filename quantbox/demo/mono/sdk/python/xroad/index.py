@@ -0,0 +1,139 @@
+##
+# @file index.py
+
+import sys
+import xroad.objects as objects
+import xroad.lib as lib
+
+_missing = object()
+
+##
+# @class hash index of cache objects by value of one field.
+# Index keeps object ids, objects are taken from cache on lookup, so index never holds dangling pointers.
+class ObjectIndex(object):
+
+    ##
+    # @param[in] obj_type - type of indexed objects @see objects.ObjectType
+    # @param[in] field    - name of indexed field. object_ref fields are indexed by id of referenced object
+    def __init__(self, obj_type, field):
+        self.__type = objects.ObjectType(obj_type)
+        self.__field = field
+        self.__read_key = objects.field_reader(self.__type, field)
+        self.__read_id = objects.field_reader(self.__type, "id")
+        self.__wrap = objects.object_factory(self.__type)
+        self.__ids = dict()   # key -> set of object ids
+        self.__keys = dict()  # object id -> key
+
+    @property
+    def object_type(self):
+        return self.__type
+
+    @property
+    def field(self):
+        return self.__field
+
+    ##
+    # count of distinct keys
+    def __len__(self):
+        return len(self.__ids)
+
+    def __contains__(self, key):
+        return self.__key(key) in self.__ids
+
+    @staticmethod
+    def __key(key):
+        return key.id if hasattr(key, "ptr") else key
+
+    ##
+    # add or move object in index
+    # @param[in] obj - object wrapper or raw object pointer
+    def update(self, obj):
+        ptr = obj.ptr if hasattr(obj, "ptr") else obj
+        obj_id = self.__read_id(ptr)
+        key = self.__read_key(ptr)
+        old = self.__keys.get(obj_id, _missing)
+        if old is not _missing:
+            if old == key:
+                return
+            self.__discard(obj_id, old)
+        if key is None:
+            self.__keys.pop(obj_id, None)
+            return
+        self.__keys[obj_id] = key
+        ids = self.__ids.get(key)
+        if ids is None:
+            self.__ids[key] = {obj_id}
+        else:
+            ids.add(obj_id)
+
+    ##
+    # remove object from index
+    # @param[in] obj_id - id of object
+    def remove(self, obj_id):
+        if obj_id in self.__keys:
+            self.__discard(obj_id, self.__keys.pop(obj_id))
+
+    def __discard(self, obj_id, key):
+        ids = self.__ids.get(key)
+        if ids is not None:
+            ids.discard(obj_id)
+            if not ids:
+                del self.__ids[key]
+
+    ##
+    # index all objects in cache
+    def rebuild(self):
+        self.__ids.clear()
+        self.__keys.clear()
+        cursor = lib.node().xroad_node_create_cursor(self.__type.value)
+        if not cursor:
+            raise RuntimeError("unable to create cursor of type '{0}'".format(self.__type.name))
+        try:
+            get_next = lib.node().xroad_node_cursor_get_next
+            obj = lib.node().xroad_node_cursor_get_first(cursor)
+            while obj:
+                self.update(obj)
+                obj = get_next(cursor)
+        finally:
+            lib.node().xroad_node_destroy_cursor(cursor)
+
+    ##
+    # get ids of objects with key
+    # @param[in] key - field value, object wrapper or id for object_ref fields
+    # @return frozenset of object ids
+    def find_ids(self, key):
+        return frozenset(self.__ids.get(self.__key(key), ()))
+
+    ##
+    # get objects with key. ids of objects which have left cache are dropped from index
+    # @param[in] key - field value, object wrapper or id for object_ref fields
+    # @return list of objects
+    def find(self, key):
+        res = []
+        get_object = lib.node().xroad_node_get_object
+        for obj_id in list(self.__ids.get(self.__key(key), ())):
+            obj = get_object(self.__type.value, obj_id)
+            if obj:
+                res.append(self.__wrap(obj))
+            else:
+                self.remove(obj_id)
+        return res
+
+    ##
+    # approximate memory taken by index, bytes
+    @property
+    def memory_usage(self):
+        size = sys.getsizeof(self.__ids) + sys.getsizeof(self.__keys)
+        for key, ids in self.__ids.items():
+            size += sys.getsizeof(key) + sys.getsizeof(ids)
+        size += sum(sys.getsizeof(i) for i in self.__keys)
+        return size
+
+    ##
+    # index statistic
+    # @return dict with counts of keys, indexed objects and memory usage
+    @property
+    def statistic(self):
+        return {"keys": len(self.__ids), "objects": len(self.__keys), "memory": self.memory_usage}
+
+# vim:et:sts=4:sw=4
@@ -15,20 +15,84 @@ class InstrDB(object):
         self.__instrdb = lib.idb().instrdb_create()
         if self.__instrdb == 0:
             raise RuntimeError('instrdb creation failed')
+        self.__by_id = dict()     # instr id -> Instr
+        self.__by_alias = dict()  # alias -> Instr
+        self.__by_name = dict()   # (name, cls) -> Instr
+        self.__by_ptr = dict()    # instr pointer -> Instr
+        self.__keys = dict()      # instr pointer -> [(cache, key)], for eviction
+        self.__ids = dict()       # instr id -> instr pointer, for eviction by notification
+        self.__hits = 0
+        self.__misses = 0
 
     def __del__(self):
         if self.__instrdb:
             lib.idb().instrdb_destroy(self.__instrdb)
 
+    ##
+    # return cached instrument wrapper. hits do not call libnode: wrappers of deleted instruments are evicted
+    # by on_instr_update, all wrappers are dropped on reconfig
+    # @param[in] cache - cache to look in
+    # @param[in] key   - cache key
+    # @return @see Instrument or None if not cached
+    def __get_cached(self, cache, key):
+        instr = cache.get(key)
+        if instr is not None:
+            self.__hits += 1
+            return instr
+        self.__misses += 1
+        return None
+
+    ##
+    # wrap instrument and put it into cache, deleted instruments are not cached
+    # @param[in] cache - cache to put in
+    # @param[in] key   - cache key
+    # @param[in] ptr   - pointer to instrument
+    # @return @see Instrument
+    def __put_cached(self, cache, key, ptr):
+        if not ptr:
+            return None
+        instr = self.__by_ptr.get(ptr)
+        if lib.node().xroad_instr_get_deleted(ptr):
+            if instr is not None:
+                self.__evict(ptr)
+            return instr or objects.Instr(ptr)
+        if instr is None:
+            instr = objects.Instr(ptr)
+            self.__by_ptr[ptr] = instr
+            self.__keys[ptr] = []
+            self.__ids[instr.id] = ptr
+        cache[key] = instr
+        self.__keys[ptr].append((cache, key))
+        return instr
+
+    ##
+    # drop wrapper of instrument from all caches
+    # @param[in] ptr - pointer to instrument
+    def __evict(self, ptr):
+        self.__ids.pop(self.__by_ptr.pop(ptr).id, None)
+        for cache, key in self.__keys.pop(ptr):
+            del cache[key]
+
+    ##
+    # notification of instrument object received from node, e.g. by Robot.on_object.
+    # cached wrapper of deleted instrument is evicted
+    # @param[in] instr - @see objects.Instr
+    def on_instr_update(self, instr):
+        if instr.deleted:
+            ptr = instr.ptr if instr.ptr in self.__by_ptr else self.__ids.get(instr.id)
+            if ptr is not None:
+                self.__evict(ptr)
+
     ##
     # gets instrument by its alias
     # @param[in] alias - instrument alias
     # @return @see Instrument
     def get_by_alias(self, alias):
-        i = lib.idb().instrdb_get_by_alias(self.__instrdb, Str(alias))
-        if i:
-            return objects.Instr(i)
-        return None
+        instr = self.__get_cached(self.__by_alias, alias)
+        if instr is None:
+            instr = self.__put_cached(self.__by_alias, alias,
+                                      lib.idb().instrdb_get_by_alias(self.__instrdb, Str(alias)))
+        return instr
 
     ##
     # gets instrument by its name and class
@@ -36,20 +100,48 @@ class InstrDB(object):
     # @param[in] cls   - instrument class
     # @return @see Instrument
     def get_by_name(self, name, cls):
-        i = lib.idb().instrdb_get_by_name(self.__instrdb, Str(name), Str(cls))
-        if i:
-            return objects.Instr(i)
-        return None
+        instr = self.__get_cached(self.__by_name, (name, cls))
+        if instr is None:
+            instr = self.__put_cached(self.__by_name, (name, cls),
+                                      lib.idb().instrdb_get_by_name(self.__instrdb, Str(name), Str(cls)))
+        return instr
 
     ##
     # gets instrument by its instr id
     # @param[in] id - instrument id
     # @return @see Instrument
     def get_by_id(self, instr_id):
-        i = lib.idb().instrdb_get_by_id(self.__instrdb, instr_id)
-        if i:
-            return objects.Instr(i)
-        return None
+        instr = self.__get_cached(self.__by_id, instr_id)
+        if instr is None:
+            instr = self.__put_cached(self.__by_id, instr_id,
+                                      lib.idb().instrdb_get_by_id(self.__instrdb, instr_id))
+        return instr
+
+    ##
+    # drop all cached instrument wrappers
+    def invalidate_instr_cache(self):
+        self.__by_id.clear()
+        self.__by_alias.clear()
+        self.__by_name.clear()
+        self.__by_ptr.clear()
+        self.__keys.clear()
+        self.__ids.clear()
+
+    ##
+    # reconfigure instrument database and drop cached instrument wrappers
+    # @param[in] cfg - instrdb configuration @see Config
+    def reconfig_instrdb(self, cfg):
+        res = lib.idb().instrdb_reconfig(self.__instrdb, cfg.ptr)
+        self.invalidate_instr_cache()
+        if res != 0:
+            raise RuntimeError("instrdb reconfiguration failed, error = {0}".format(res))
+
+    ##
+    # instrument cache statistic
+    # @return dict with counts of hits, misses and distinct cached wrappers
+    @property
+    def instr_cache_statistic(self):
+        return {"hits": self.__hits, "misses": self.__misses, "size": len(self.__by_ptr)}
 
     ##
     # create instrument
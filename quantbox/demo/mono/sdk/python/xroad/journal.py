@@ -0,0 +1,309 @@
+##
+# @file journal.py
+# market data journal: append-only file of fixed-size records, written through mmap.
+# Readers map the same file read-only and see records up to the count stored in header.
+# Records keep receive time of two clocks: rcv_ts of time.monotonic_ns(), which orders records and is searched,
+# and wall_ts of time.time_ns(), which is for display only, it may go backwards. Monotonic clock starts over
+# on reboot, so journal appended after reboot is not in rcv_ts order.
+
+import ctypes
+import mmap
+import os
+import time
+
+from xroad import mdata_ctypes
+from xroad.mdata import ProtoType, Book, Quote, Trade, CommonInfo
+
+JOURNAL_MAGIC = b"XRMDJRN1"
+JOURNAL_VERSION = 2
+
+
+class JournalHeaderCTypes(ctypes.Structure):
+    _pack_ = 4
+    _fields_ = [("magic", ctypes.c_char * 8),
+                ("version", ctypes.c_uint32),
+                ("record_size", ctypes.c_uint32),
+                ("count", ctypes.c_uint64),
+                ("reserved", ctypes.c_uint8 * 40)]
+
+
+class RecordHeaderCTypes(ctypes.Structure):
+    _pack_ = 4
+    _fields_ = [("rcv_ts", ctypes.c_uint64),
+                ("wall_ts", ctypes.c_uint64),
+                ("md_type", ctypes.c_int32),
+                ("size", ctypes.c_int32)]
+
+
+# proto type -> (ctypes structure, wrapper class)
+_record_types = {ProtoType.book: (mdata_ctypes.Book_20CTypes, Book),
+                 ProtoType.quote: (mdata_ctypes.QuoteCTypes, Quote),
+                 ProtoType.trade: (mdata_ctypes.TradeCTypes, Trade),
+                 ProtoType.common_info: (mdata_ctypes.CommonInfoCTypes, CommonInfo)}
+
+_header_size = ctypes.sizeof(JournalHeaderCTypes)
+_record_header_size = ctypes.sizeof(RecordHeaderCTypes)
+_record_size = _record_header_size + max(ctypes.sizeof(t) for t, _ in _record_types.values())
+_count_offset = JournalHeaderCTypes.count.offset
+
+
+##
+# @class writes market data into journal. Attach it by MarketData.attach_recorder
+class Recorder(object):
+
+    ##
+    # @param[in] path     - journal file, appended if exists
+    # @param[in] capacity - initial count of records in file, file is doubled when it is full
+    def __init__(self, path, capacity=1 << 20):
+        self.__fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.__mm = None
+        self.__grow_by = capacity
+        size = os.fstat(self.__fd).st_size
+        if size == 0:
+            hdr = JournalHeaderCTypes(JOURNAL_MAGIC, JOURNAL_VERSION, _record_size, 0)
+            os.ftruncate(self.__fd, _header_size + capacity * _record_size)
+            os.pwrite(self.__fd, bytes(hdr), 0)
+        else:
+            hdr = JournalHeaderCTypes.from_buffer_copy(os.pread(self.__fd, _header_size, 0))
+            if hdr.magic != JOURNAL_MAGIC or hdr.record_size != _record_size:
+                os.close(self.__fd)
+                raise RuntimeError("{0} is not a market data journal of version {1}".format(path, JOURNAL_VERSION))
+        self.__count = hdr.count
+        self.__rec = RecordHeaderCTypes()
+        self.__rec_addr = ctypes.addressof(self.__rec)
+        self.__map()
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, traceback):
+        self.close()
+
+    def __map(self):
+        size = os.fstat(self.__fd).st_size
+        self.__mm = mmap.mmap(self.__fd, size)
+        self.__capacity = (size - _header_size) // _record_size
+        self.__base = ctypes.c_char.from_buffer(self.__mm)
+        self.__addr = ctypes.addressof(self.__base) + _header_size
+        self.__committed = ctypes.c_uint64.from_buffer(self.__mm, _count_offset)
+
+    def __unmap(self):
+        # exported buffers must be released before mmap is closed
+        self.__base = None
+        self.__committed = None
+        self.__mm.close()
+        self.__mm = None
+
+    def __grow(self):
+        self.__unmap()
+        capacity = self.__capacity + max(self.__capacity, self.__grow_by)
+        os.ftruncate(self.__fd, _header_size + capacity * _record_size)
+        self.__map()
+
+    ##
+    # count of records in journal
+    def __len__(self):
+        return self.__count
+
+    ##
+    # append record, it becomes visible for readers after header count is updated
+    # @param[in] md_type - type of market data @see ProtoType
+    # @param[in] mdata   - address of market data
+    def record(self, md_type, mdata):
+        rec_type = _record_types.get(md_type)
+        if rec_type is None:
+            return
+        if self.__count == self.__capacity:
+            self.__grow()
+        rec = self.__rec
+        rec.rcv_ts = time.monotonic_ns()
+        rec.wall_ts = time.time_ns()
+        rec.md_type = md_type
+        rec.size = ctypes.sizeof(rec_type[0])
+        addr = self.__addr + self.__count * _record_size
+        ctypes.memmove(addr, self.__rec_addr, _record_header_size)
+        ctypes.memmove(addr + _record_header_size, mdata, rec.size)
+        self.__count += 1
+        self.__committed.value = self.__count
+
+    ##
+    # flush written records to disk
+    def flush(self):
+        if self.__mm is not None:
+            self.__mm.flush()
+
+    ##
+    # flush and close journal
+    def close(self):
+        if self.__mm is not None:
+            self.__mm.flush()
+            self.__unmap()
+            os.close(self.__fd)
+
+
+##
+# @class reads journal, which can be written by Recorder at the same time
+class JournalReader(object):
+
+    ##
+    # @param[in] path - journal file
+    def __init__(self, path):
+        self.__path = path
+        self.__fd = os.open(path, os.O_RDONLY)
+        self.__mm = None
+        hdr = JournalHeaderCTypes.from_buffer_copy(os.pread(self.__fd, _header_size, 0))
+        if hdr.magic != JOURNAL_MAGIC or hdr.record_size != _record_size:
+            os.close(self.__fd)
+            raise RuntimeError("{0} is not a market data journal of version {1}".format(path, JOURNAL_VERSION))
+        self.__records = None
+        self.__instr_index = None  # (record indexes sorted by instr_id, sorted instr_ids)
+        self.refresh()
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, traceback):
+        self.close()
+
+    ##
+    # unmap file. numpy views of records taken before keep their mapping alive, it is unmapped
+    # with the last of them
+    def __unmap(self):
+        self.__records = None
+        self.__instr_index = None
+        try:
+            self.__mm.close()
+        except BufferError:
+            pass
+        self.__mm = None
+
+    ##
+    # pick up records appended since open or previous refresh. file is mapped again if it has grown,
+    # views of records taken before stay valid and show records known at the time they were taken
+    # @return count of records
+    def refresh(self):
+        size = os.fstat(self.__fd).st_size
+        if self.__mm is None or len(self.__mm) != size:
+            if self.__mm is not None:
+                self.__unmap()
+            self.__mm = mmap.mmap(self.__fd, size, access=mmap.ACCESS_READ)
+        count = JournalHeaderCTypes.from_buffer_copy(self.__mm, 0).count
+        self.__count = min(count, (size - _header_size) // _record_size)
+        self.__records = None
+        self.__instr_index = None
+        return self.__count
+
+    def __len__(self):
+        return self.__count
+
+    ##
+    # gets record
+    # @param[in] index - index of record
+    # @return (monotonic receive timestamp, wrapper of market data copy) @see Book, Quote, Trade, CommonInfo
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.__count
+        if not 0 <= index < self.__count:
+            raise IndexError("record index {0} out of bounds".format(index))
+        offset = _header_size + index * _record_size
+        rec = RecordHeaderCTypes.from_buffer_copy(self.__mm, offset)
+        ctype, cls = _record_types[ProtoType(rec.md_type)]
+        data = ctype.from_buffer_copy(self.__mm, offset + _record_header_size)
+        return rec.rcv_ts, cls(None, ctypes.pointer(data))
+
+    def __iter__(self):
+        for n in range(self.__count):
+            yield self[n]
+
+    ##
+    # zero-copy numpy view of records, requires numpy
+    # @return structured array with fields rcv_ts, wall_ts, md_type, size and instr_id
+    @property
+    def records(self):
+        if self.__records is None:
+            import numpy
+            rec = RecordHeaderCTypes
+            dtype = numpy.dtype({"names": ["rcv_ts", "wall_ts", "md_type", "size", "instr_id"],
+                                 "formats": [numpy.uint64, numpy.uint64, numpy.int32, numpy.int32, numpy.uint64],
+                                 "offsets": [rec.rcv_ts.offset, rec.wall_ts.offset, rec.md_type.offset,
+                                             rec.size.offset, _record_header_size],
+                                 "itemsize": _record_size})
+            self.__records = numpy.frombuffer(self.__mm, dtype, self.__count, _header_size)
+        return self.__records
+
+    ##
+    # size of record, records are located in file one by one
+    @property
+    def record_size(self):
+        return _record_size
+
+    ##
+    # gets address of market data of record in mapped file, requires numpy.
+    # address is valid till refresh() or close(), data is read-only
+    # @param[in] index - index of record
+    def address(self, index):
+        if not 0 <= index < self.__count:
+            raise IndexError("record index {0} out of bounds".format(index))
+        return self.records.ctypes.data + index * _record_size + _record_header_size
+
+    ##
+    # zero-copy numpy view of market data of one type, requires numpy
+    # @param[in] md_type - type of market data @see ProtoType
+    # @param[in] index   - indexes of records, e.g. from find(). all records if None
+    # @return structured array with fields rcv_ts, wall_ts and data, data is record of md_type structure
+    def as_numpy(self, md_type, index=None):
+        import numpy
+        ctype, _ = _record_types[ProtoType(md_type)]
+        dtype = numpy.dtype({"names": ["rcv_ts", "wall_ts", "data"],
+                             "formats": [numpy.uint64, numpy.uint64, numpy.dtype(ctype)],
+                             "offsets": [RecordHeaderCTypes.rcv_ts.offset, RecordHeaderCTypes.wall_ts.offset,
+                                         _record_header_size],
+                             "itemsize": _record_size})
+        res = numpy.frombuffer(self.__mm, dtype, self.__count, _header_size)
+        mask = self.records["md_type"] == md_type
+        if index is not None:
+            return res[index][mask[index]]
+        return res[mask]
+
+    ##
+    # index of records by instrument, built on first use after open or refresh, requires numpy.
+    # records of each instrument keep receive time order
+    # @return (record indexes sorted by instr_id, instr_ids of them)
+    def __get_instr_index(self):
+        if self.__instr_index is None:
+            ids = self.records["instr_id"]
+            order = ids.argsort(kind="stable")
+            self.__instr_index = (order, ids[order])
+        return self.__instr_index
+
+    ##
+    # find records by instrument and receive time. records are in receive time order
+    # @param[in] instr_id - id of instrument, any if None
+    # @param[in] start    - min receive timestamp of time.monotonic_ns(), ns
+    # @param[in] stop     - receive timestamp of time.monotonic_ns() to stop at, ns
+    # @return numpy array of record indexes
+    def find(self, instr_id=None, start=None, stop=None):
+        import numpy
+        recs = self.records
+        first = 0 if start is None else numpy.searchsorted(recs["rcv_ts"], start, "left")
+        last = len(recs) if stop is None else numpy.searchsorted(recs["rcv_ts"], stop, "left")
+        if instr_id is None:
+            return numpy.arange(first, last)
+        order, ids = self.__get_instr_index()
+        index = order[ids.searchsorted(instr_id, "left"):ids.searchsorted(instr_id, "right")]
+        return index[index.searchsorted(first, "left"):index.searchsorted(last, "left")]
+
+    ##
+    # close journal, views of records taken before stay valid
+    def close(self):
+        if self.__mm is not None:
+            self.__unmap()
+            os.close(self.__fd)
+
+# vim:et:sts=4:sw=4
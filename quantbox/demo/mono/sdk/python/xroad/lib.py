@@ -5,7 +5,7 @@
 import ctypes
 import os
 from xroad.xtypes import Str, Path
-from xroad.mdata_ctypes import ServerCallbackCTypes,ClientCallbackCTypes, ChannelCallbackCTypes
+from xroad.mdata_ctypes import ServerCallbackCTypes,ClientCallbackCTypes, ChannelCallbackCTypes, on_book_level_type
 from xroad.order_ctypes import OrderCallbackCTypes
 
 
@@ -42,6 +42,7 @@ __libidb = None
 __libmdata_engine = None
 __liborder = None
 __libui = None
+__libmdata_book = dict()  # backend -> library
 
 
 def node():
@@ -86,6 +87,43 @@ def ui():
     return __libui
 
 
+##
+# gets full depth book library. backends export the same functions, so they are loaded on demand
+# without RTLD_GLOBAL
+# @param[in] backend - "arr" or "map"
+def mdata_book(backend="arr"):
+    if __libcommon is None:
+        raise RuntimeError("do lib.init() first")
+    lib = __libmdata_book.get(backend)
+    if lib is None:
+        if backend not in ("arr", "map"):
+            raise RuntimeError("unknown mdata_book backend '{0}'".format(backend))
+        lib = ctypes.CDLL(os.path.join(os.environ['XROAD_ROOT_DIR'], 'sdk/lib/libmdata_book_{0}.so'.format(backend)))
+        lib.mdata_book_create.restype = ctypes.c_void_p
+        lib.mdata_book_create.argtypes = [ctypes.c_void_p]
+        lib.mdata_book_destroy.argtypes = [ctypes.c_void_p]
+        lib.mdata_book_clear.argtypes = [ctypes.c_void_p]
+        lib.mdata_book_update.restype = ctypes.c_int32
+        lib.mdata_book_update.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_double, ctypes.c_int64,
+                                          ctypes.c_int, ctypes.c_uint64]
+        lib.mdata_book_order_update.restype = ctypes.c_int32
+        lib.mdata_book_order_update.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int64, ctypes.c_double,
+                                                ctypes.c_int64, ctypes.c_int, ctypes.c_uint64]
+        lib.mdata_book_get_instr.restype = ctypes.c_void_p
+        lib.mdata_book_get_instr.argtypes = [ctypes.c_void_p]
+        lib.mdata_book_is_crossed.restype = ctypes.c_bool
+        lib.mdata_book_is_crossed.argtypes = [ctypes.c_void_p]
+        lib.mdata_book_is_empty.restype = ctypes.c_bool
+        lib.mdata_book_is_empty.argtypes = [ctypes.c_void_p]
+        lib.mdata_book_get_levels.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int32, on_book_level_type,
+                                              ctypes.c_void_p]
+        lib.mdata_book_print.argtypes = [ctypes.c_void_p]
+        lib.mdata_quote_update_book.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        lib.mdata_book_20_update_book.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        __libmdata_book[backend] = lib
+    return lib
+
+
 def init():
     global __libnode
     __libnode = ctypes.CDLL(os.path.join(os.environ["XROAD_ROOT_DIR"], "sdk/lib/libnode.so"), ctypes.RTLD_GLOBAL)
@@ -101,6 +139,7 @@ def init():
     __libnode.xroad_node_get_cfg.restype = ctypes.c_void_p
     __libnode.xroad_node_create_cursor.argtypes = [ctypes.c_int]
     __libnode.xroad_node_create_cursor.restype = ctypes.c_void_p
+    __libnode.xroad_node_destroy_cursor.argtypes = [ctypes.c_void_p]
     __libnode.xroad_node_cursor_get_first.restype = ctypes.c_void_p
     __libnode.xroad_node_cursor_get_first.argtypes = [ctypes.c_void_p]
     __libnode.xroad_node_cursor_get_next.restype = ctypes.c_void_p
@@ -115,6 +154,8 @@ def init():
     __libnode.xroad_node_get_object.restype = ctypes.c_void_p
     __libnode.xroad_object_get_type.argtypes = [ctypes.c_void_p]
     __libnode.xroad_object_get_type.restype = ctypes.c_int
+    __libnode.xroad_object_get_id.argtypes = [ctypes.c_void_p]
+    __libnode.xroad_object_get_id.restype = ctypes.c_ulong
     __libnode.xroad_node_shrink_cache.argtypes = [ctypes.c_int, ctypes.c_long]
     __libnode.xroad_object_get_type.argtypes = [ctypes.c_void_p]
     __libnode.xroad_object_get_type.restype = ctypes.c_int
@@ -134,6 +175,9 @@ def init():
     __libnode.xroad_node_get_version.restype = ctypes.c_void_p
     __libnode.xroad_node_is_initialized.restype = ctypes.c_bool
 
+    from xroad import objects
+    objects.bind_prototypes(__libnode)
+
     global __libcommon
     __libcommon = ctypes.CDLL(os.path.join(os.environ["XROAD_ROOT_DIR"], "sdk/lib/libcommon.so"), ctypes.RTLD_GLOBAL)
     __libcommon.xroad_xml_get_root.restype = ctypes.c_void_p
@@ -194,6 +238,7 @@ def init():
     __libidb.instrdb_get_by_name.restype = ctypes.c_void_p
     __libidb.instrdb_add.argtypes = [ctypes.c_void_p, Str, Str, Str, Str]
     __libidb.instrdb_add.restype = ctypes.c_void_p
+    __libidb.instrdb_reconfig.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
 
     global __libmdata_engine
     __libmdata_engine = ctypes.CDLL(os.path.join(os.environ['XROAD_ROOT_DIR'], 'sdk/lib/libmdata.so'), ctypes.RTLD_GLOBAL)
@@ -209,6 +254,16 @@ def init():
     __libmdata_engine.mdata_engine_subscribe.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ChannelCallbackCTypes]
     __libmdata_engine.mdata_engine_send.restype = ctypes.c_int
     __libmdata_engine.mdata_engine_send.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p]
+    __libmdata_engine.mdata_engine_put.restype = ctypes.c_int
+    __libmdata_engine.mdata_engine_put.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
+    __libmdata_engine.mdata_engine_flush.restype = ctypes.c_int
+    __libmdata_engine.mdata_engine_flush.argtypes = [ctypes.c_void_p]
+    __libmdata_engine.mdata_engine_get_book.restype = ctypes.c_void_p
+    __libmdata_engine.mdata_engine_get_book.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+    __libmdata_engine.mdata_engine_get_quote.restype = ctypes.c_void_p
+    __libmdata_engine.mdata_engine_get_quote.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+    __libmdata_engine.mdata_engine_get_trade.restype = ctypes.c_void_p
+    __libmdata_engine.mdata_engine_get_trade.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
 
     global __liborder
     __liborder = ctypes.CDLL(os.path.join(os.environ['XROAD_ROOT_DIR'], 'sdk/lib/liborder.so'), ctypes.RTLD_GLOBAL)
@@ -222,7 +277,7 @@ def init():
     __liborder.order_cancel.restype = ctypes.c_int
     __liborder.order_cancel.argtypes = [ctypes.c_void_p]
     __liborder.order_replace.restype = ctypes.c_int
-    __liborder.order_replace.argtypes = [ctypes.c_void_p, ctypes.c_long, ctypes.c_double, ctypes.c_int]
+    __liborder.order_replace.argtypes = [ctypes.c_void_p, ctypes.c_long, ctypes.c_double, Str, ctypes.c_int]
     __liborder.order_reset.argtypes = [ctypes.c_void_p]
     __liborder.order_on_node_object.argtypes = [ctypes.c_void_p, ctypes.c_ushort]
     __liborder.order_get_name.restype = Str
@@ -233,6 +288,8 @@ def init():
     __liborder.order_get_side.argtypes = [ctypes.c_void_p]
     __liborder.order_get_qty.restype = ctypes.c_long
     __liborder.order_get_qty.argtypes = [ctypes.c_void_p]
+    __liborder.order_get_leaves_qty.restype = ctypes.c_long
+    __liborder.order_get_leaves_qty.argtypes = [ctypes.c_void_p]
     __liborder.order_get_price.restype = ctypes.c_double
     __liborder.order_get_price.argtypes = [ctypes.c_void_p]
     __liborder.order_get_ctx.restype = ctypes.c_void_p
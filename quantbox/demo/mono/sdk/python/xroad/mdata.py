@@ -3,11 +3,13 @@
 # @author Danil Krivopustov, krivopustovda@gmail.com
 
 import ctypes
+import time
 from enum import IntEnum
 
 import xroad.xtypes as xtypes
 from xroad import mdata_ctypes
 from xroad import lib
+from xroad.common import Timer
 import logging
 
 
@@ -61,6 +63,43 @@ class CommonInfoType(IntEnum):
     Volume = 128
 
 
+_book_ptr = ctypes.POINTER(mdata_ctypes.Book_20CTypes)
+_level_dtype = None
+_quote_ptr = ctypes.POINTER(mdata_ctypes.QuoteCTypes)
+_trade_ptr = ctypes.POINTER(mdata_ctypes.TradeCTypes)
+_common_info_ptr = ctypes.POINTER(mdata_ctypes.CommonInfoCTypes)
+_quote_bid_offset = mdata_ctypes.QuoteCTypes.bid.offset
+_quote_ask_offset = mdata_ctypes.QuoteCTypes.ask.offset
+# side of book helpers and FullBook is either @see SideType or @see xtypes.Side
+_is_ask_side = {SideType.Ask: True, SideType.Bid: False, xtypes.Side.sell: True, xtypes.Side.buy: False}
+_xroad_side = {SideType.Ask: int(xtypes.Side.sell), SideType.Bid: int(xtypes.Side.buy),
+               xtypes.Side.sell: int(xtypes.Side.sell), xtypes.Side.buy: int(xtypes.Side.buy)}
+
+
+##
+# gets numpy dtype of BookLevelCTypes, requires numpy
+def _get_level_dtype():
+    global _level_dtype
+    if _level_dtype is None:
+        import numpy
+        level = mdata_ctypes.BookLevelCTypes
+        _level_dtype = numpy.dtype({"names": ["price", "qty"],
+                                    "formats": [numpy.float64, numpy.int64],
+                                    "offsets": [level.price.offset, level.qty.offset],
+                                    "itemsize": ctypes.sizeof(level)})
+    return _level_dtype
+
+
+##
+# gets value of side from table of sides
+# @exception ValueError if side is neither SideType nor buy or sell of xtypes.Side
+def _map_side(table, side):
+    try:
+        return table[side]
+    except (KeyError, TypeError):
+        raise ValueError("{0} is not a valid side".format(side))
+
+
 ##
 # Book level class
 class BookLevel(object):
@@ -70,6 +109,18 @@ class BookLevel(object):
             self.__level = ctypes.pointer(mdata_ctypes.BookLevelCTypes())
         else:
             self.__level = level
+        self.__addr = ctypes.c_void_p.from_buffer(self.__level)  # rebound by _reset
+
+    ##
+    # rebind level to another address, used by Quote to reuse levels
+    # @param[in] level - address of level
+    def _reset(self, level):
+        self.__addr.value = level
+
+    ##
+    # gets copy of level, which owns its data
+    def copy(self):
+        return BookLevel(ctypes.pointer(mdata_ctypes.BookLevelCTypes.from_buffer_copy(self.__level.contents)))
 
     ##
     # gets qty of level
@@ -107,6 +158,18 @@ class Book(object):
             self.__book.contents.instr_id = instr.id
         else:
             self.__book = book
+        self.__addr = ctypes.c_void_p.from_buffer(self.__book)  # rebound by _reset
+
+    ##
+    # rebind wrapper to another book, used by MarketData to reuse wrappers
+    # @param[in] book - pointer to book
+    def _reset(self, book):
+        self.__addr.value = book
+
+    ##
+    # gets copy of book, which owns its data. Use it to keep book after on_mdata_book returns
+    def copy(self):
+        return Book(self.__instr, ctypes.pointer(mdata_ctypes.Book_20CTypes.from_buffer_copy(self.__book.contents)))
 
     ##
     # gets exchange ts
@@ -138,6 +201,28 @@ class Book(object):
     def instr(self):
         return self.__instr
 
+    ##
+    # gets id of instrument, read from book itself
+    @property
+    def instr_id(self):
+        return self.__book.contents.instr_id
+
+    ##
+    # gets levels of side as plain values, cheaper than get_bid/get_ask for reading many levels
+    # @param[in] side  - @see SideType or @see xtypes.Side, sell is ask side
+    # @param[in] depth - max count of levels
+    # @return list of [price, qty] of non-empty levels, best level first
+    def get_levels(self, side, depth=20):
+        book = self.__book.contents
+        levels = book.asks if _map_side(_is_ask_side, side) else book.bids
+        res = []
+        for n in range(min(depth, 20)):
+            level = levels[n]
+            if not level.qty:
+                break
+            res.append([level.price, level.qty])
+        return res
+
     ##
     # gets bids level by index
     # @param[in] index - index of level
@@ -174,6 +259,73 @@ class Book(object):
         else:
             raise IndexError('ask index {0} out of bounds'.format(index))
 
+    ##
+    # zero-copy numpy views over book levels, requires numpy.
+    # views are valid while book memory is, i.e. during on_mdata_book callback
+    # @return (asks, bids) structured arrays of shape (20,) with fields price and qty
+    def as_numpy(self):
+        import numpy
+        dtype = _get_level_dtype()
+        book = self.__book.contents
+        return numpy.frombuffer(book.asks, dtype), numpy.frombuffer(book.bids, dtype)
+
+    ##
+    # gets levels of side as numpy view
+    # @param[in] side - @see SideType or @see xtypes.Side
+    def __levels(self, side):
+        is_ask = _map_side(_is_ask_side, side)
+        asks, bids = self.as_numpy()
+        return asks if is_ask else bids
+
+    ##
+    # gets mid price of best levels
+    # @return mid price or None if any side is empty
+    def mid(self):
+        book = self.__book.contents
+        ask, bid = book.asks[0], book.bids[0]
+        if ask.qty and bid.qty:
+            return (ask.price + bid.price) / 2
+
+    ##
+    # gets mid price weighted by qty of best levels
+    # @return microprice or None if any side is empty
+    def microprice(self):
+        book = self.__book.contents
+        ask, bid = book.asks[0], book.bids[0]
+        if ask.qty and bid.qty:
+            return (ask.price * bid.qty + bid.price * ask.qty) / (ask.qty + bid.qty)
+
+    ##
+    # gets qty weighted price of side over first levels, requires numpy
+    # @param[in] side  - @see SideType or @see xtypes.Side
+    # @param[in] depth - count of levels
+    # @return price or None if side is empty
+    def depth_price(self, side, depth=20):
+        levels = self.__levels(side)[:depth]
+        total = levels["qty"].sum()
+        if total:
+            return float((levels["price"] * levels["qty"]).sum() / total)
+
+    ##
+    # gets cumulative qty of side by levels, requires numpy
+    # @param[in] side - @see SideType or @see xtypes.Side
+    # @return numpy array of shape (20,)
+    def cum_qty(self, side):
+        return self.__levels(side)["qty"].cumsum()
+
+    ##
+    # gets average price of filling qty from side, requires numpy
+    # @param[in] side - @see SideType or @see xtypes.Side
+    # @param[in] qty  - qty to fill
+    # @return price or None if depth of side is less than qty
+    def fill_price(self, side, qty):
+        levels = self.__levels(side)
+        cum = levels["qty"].cumsum()
+        if qty <= 0 or cum[-1] < qty:
+            return None
+        filled = (levels["qty"] - (cum - qty).clip(0, None)).clip(0, None)
+        return float((levels["price"] * filled).sum() / qty)
+
     ##
     # sends data to consumers
     def send(self, mdata):
@@ -191,6 +343,19 @@ class CommonInfo(object):
             self.__info.contents.instr_id = instr.id
         else:
             self.__info = info
+        self.__addr = ctypes.c_void_p.from_buffer(self.__info)  # rebound by _reset
+
+    ##
+    # rebind wrapper to another common info, used by MarketData to reuse wrappers
+    # @param[in] info - pointer to common info
+    def _reset(self, info):
+        self.__addr.value = info
+
+    ##
+    # gets copy of common info, which owns its data. Use it to keep info after on_mdata_common_info returns
+    def copy(self):
+        return CommonInfo(self.__instr,
+                          ctypes.pointer(mdata_ctypes.CommonInfoCTypes.from_buffer_copy(self.__info.contents)))
 
     ##
     # gets local ts
@@ -359,6 +524,18 @@ class Trade(object):
             self.__trade.contents.instr_id = instr.id
         else:
             self.__trade = trade
+        self.__addr = ctypes.c_void_p.from_buffer(self.__trade)  # rebound by _reset
+
+    ##
+    # rebind wrapper to another trade, used by MarketData to reuse wrappers
+    # @param[in] trade - pointer to trade
+    def _reset(self, trade):
+        self.__addr.value = trade
+
+    ##
+    # gets copy of trade, which owns its data. Use it to keep trade after on_mdata_trade returns
+    def copy(self):
+        return Trade(self.__instr, ctypes.pointer(mdata_ctypes.TradeCTypes.from_buffer_copy(self.__trade.contents)))
 
     ##
     # gets exchange ts
@@ -443,6 +620,22 @@ class Quote(object):
             self.__quote.contents.instr_id = instr.id
         else:
             self.__quote = quote
+        self.__addr = ctypes.c_void_p.from_buffer(self.__quote)  # rebound by _reset
+        self.__bid = BookLevel(ctypes.pointer(self.__quote.contents.bid))
+        self.__ask = BookLevel(ctypes.pointer(self.__quote.contents.ask))
+
+    ##
+    # rebind wrapper to another quote, used by MarketData to reuse wrappers
+    # @param[in] quote - pointer to quote
+    def _reset(self, quote):
+        self.__addr.value = quote
+        self.__bid._reset(quote + _quote_bid_offset)
+        self.__ask._reset(quote + _quote_ask_offset)
+
+    ##
+    # gets copy of quote, which owns its data. Use it to keep quote after on_mdata_quote returns
+    def copy(self):
+        return Quote(self.__instr, ctypes.pointer(mdata_ctypes.QuoteCTypes.from_buffer_copy(self.__quote.contents)))
 
     ##
     # gets exchange ts
@@ -478,7 +671,7 @@ class Quote(object):
     # gets best bid level
     @property
     def bid(self):
-        return BookLevel(ctypes.pointer(self.__quote.contents.bid))
+        return self.__bid
 
     ##
     # sets best bid level
@@ -491,7 +684,7 @@ class Quote(object):
     # gets best ask level
     @property
     def ask(self):
-        return BookLevel(ctypes.pointer(self.__quote.contents.ask))
+        return self.__ask
 
     ##
     # sets best ask level
@@ -518,6 +711,232 @@ class Quote(object):
         mdata.send(ProtoType.quote, self.__quote)
 
 
+##
+# describes action of full depth book update
+class BookAction(IntEnum):
+    order_add = 1
+    order_update = 2
+    order_delete = 3
+    add = 4
+    update = 5
+    delete = 6
+
+
+##
+# @class full depth book, wraps mdata_book library
+class FullBook(object):
+
+    @staticmethod
+    def __on_level(index, side, price, qty, ctx):
+        self = ctypes.cast(ctx, ctypes.py_object).value
+        n = self.__level_cnt
+        self.__level_out[n] = (price, qty)
+        self.__level_cnt = n + 1
+
+    ##
+    # @param[in] instr   - instrument of book
+    # @param[in] backend - "arr" keeps levels in array, "map" keeps levels in map
+    def __init__(self, instr, backend="arr"):
+        self.__book = None
+        self.__lib = lib.mdata_book(backend)
+        self.__book = self.__lib.mdata_book_create(instr.ptr)
+        if not self.__book:
+            raise RuntimeError("unable to create book of instrument {0}".format(instr.id))
+        self.__instr = instr
+        self.__book_20 = ctypes.pointer(mdata_ctypes.Book_20CTypes())
+        self.__book_20.contents.instr_id = instr.id
+        self.__quote = ctypes.pointer(mdata_ctypes.QuoteCTypes())
+        self.__quote.contents.instr_id = instr.id
+        self.__on_level_fun = mdata_ctypes.on_book_level_type(FullBook.__on_level)
+        self.__level_out = None
+        self.__level_cnt = 0
+
+    def __del__(self):
+        if self.__book:
+            self.__lib.mdata_book_destroy(self.__book)
+            self.__book = None
+
+    ##
+    # gets instrument
+    @property
+    def instr(self):
+        return self.__instr
+
+    ##
+    # true if best bid >= best ask
+    @property
+    def is_crossed(self):
+        return self.__lib.mdata_book_is_crossed(self.__book)
+
+    ##
+    # true if book is empty
+    @property
+    def is_empty(self):
+        return self.__lib.mdata_book_is_empty(self.__book)
+
+    ##
+    # removes all levels
+    def clear(self):
+        self.__lib.mdata_book_clear(self.__book)
+
+    ##
+    # updates level of book
+    # @param[in] action - @see BookAction
+    # @param[in] price  - price of level
+    # @param[in] qty    - qty of level
+    # @param[in] side   - @see xtypes.Side or @see SideType
+    # @param[in] ts     - timestamp of update
+    # @return True if best bid or best ask have changed
+    def update(self, action, price, qty, side, ts=0):
+        side = _map_side(_xroad_side, side)
+        return self.__lib.mdata_book_update(self.__book, action, price, qty, side, ts) == 1
+
+    ##
+    # updates book by order
+    # @param[in] action   - @see BookAction
+    # @param[in] order_id - id of order
+    # @param[in] price    - price of order
+    # @param[in] qty      - qty of order
+    # @param[in] side     - @see xtypes.Side or @see SideType
+    # @param[in] ts       - timestamp of update
+    # @return True if best bid or best ask have changed
+    def order_update(self, action, order_id, price, qty, side, ts=0):
+        side = _map_side(_xroad_side, side)
+        return self.__lib.mdata_book_order_update(self.__book, action, order_id, price, qty, side, ts) == 1
+
+    ##
+    # applies level updates, columns are sequences or numpy arrays of the same length.
+    # mdata_book has no batch call, it is a python loop with one mdata_book_update call per row,
+    # it saves per-row method dispatch only
+    # @return count of updates, which have changed best bid or best ask
+    def update_many(self, actions, prices, qtys, sides, ts):
+        fun = self.__lib.mdata_book_update
+        book = self.__book
+        sides = [_map_side(_xroad_side, side) for side in _to_list(sides)]
+        changed = 0
+        for args in zip(*map(_to_list, (actions, prices, qtys, sides, ts))):
+            if fun(book, *args) == 1:
+                changed += 1
+        return changed
+
+    ##
+    # applies order updates, e.g. from order log, columns are sequences or numpy arrays of the same length.
+    # mdata_book has no batch call, it is a python loop with one mdata_book_order_update call per row
+    # @return count of updates, which have changed best bid or best ask
+    def order_update_many(self, actions, order_ids, prices, qtys, sides, ts):
+        fun = self.__lib.mdata_book_order_update
+        book = self.__book
+        sides = [_map_side(_xroad_side, side) for side in _to_list(sides)]
+        changed = 0
+        for args in zip(*map(_to_list, (actions, order_ids, prices, qtys, sides, ts))):
+            if fun(book, *args) == 1:
+                changed += 1
+        return changed
+
+    ##
+    # gets levels of side, requires numpy
+    # @param[in] side  - @see xtypes.Side or @see SideType
+    # @param[in] depth - max count of levels
+    # @return numpy structured array with fields price and qty, best level first
+    def levels(self, side, depth=20):
+        import numpy
+        self.__level_out = numpy.zeros(depth, _get_level_dtype())
+        self.__level_cnt = 0
+        try:
+            self.__lib.mdata_book_get_levels(self.__book, _map_side(_xroad_side, side), depth, self.__on_level_fun,
+                                             id(self))
+            return self.__level_out[:self.__level_cnt]
+        finally:
+            self.__level_out = None
+
+    ##
+    # gets top 20 levels, filled by mdata_book library in one call
+    # @return @see Book, which is overwritten by next call
+    def as_book(self):
+        self.__lib.mdata_book_20_update_book(self.__book_20, self.__book)
+        return Book(self.__instr, self.__book_20)
+
+    ##
+    # gets best levels, filled by mdata_book library in one call
+    # @return @see Quote, which is overwritten by next call
+    def as_quote(self):
+        self.__lib.mdata_quote_update_book(self.__quote, self.__book)
+        return Quote(self.__instr, self.__quote)
+
+    ##
+    # prints book into log
+    def print(self):
+        self.__lib.mdata_book_print(self.__book)
+
+
+def _to_list(col):
+    return col.tolist() if hasattr(col, "tolist") else col
+
+
+##
+# @class contiguous buffer of market data records of one type, collected during receive cycle
+class MdataBatch(object):
+
+    ##
+    # @param[in] ctype    - ctypes structure of record
+    # @param[in] capacity - initial count of records, buffer grows if exceeded
+    def __init__(self, ctype, capacity):
+        self.__ctype = ctype
+        self.__size = ctypes.sizeof(ctype)
+        self.__count = 0
+        self.__alloc(capacity)
+
+    def __alloc(self, capacity):
+        self.__buf = (self.__ctype * capacity)()
+        self.__addr = ctypes.addressof(self.__buf)
+        self.__capacity = capacity
+
+    def __len__(self):
+        return self.__count
+
+    ##
+    # append copy of record
+    # @param[in] data - address of record
+    def put(self, data):
+        if self.__count == self.__capacity:
+            buf = self.__buf
+            self.__alloc(self.__capacity * 2)
+            ctypes.memmove(self.__addr, buf, self.__count * self.__size)
+        ctypes.memmove(self.__addr + self.__count * self.__size, data, self.__size)
+        self.__count += 1
+
+    ##
+    # drop all records, buffer is kept
+    def clear(self):
+        self.__count = 0
+
+    ##
+    # zero-copy numpy structured array of records, requires numpy.
+    # array is valid till the next receive cycle
+    @property
+    def records(self):
+        import numpy
+        return numpy.frombuffer(self.__buf, numpy.dtype(self.__ctype), self.__count)
+
+
+##
+# @class scope of batched publishing, @see MarketData.batch
+class PublishBatch(object):
+
+    def __init__(self, mdata, max_size, max_latency):
+        self.__mdata = mdata
+        self.__max_size = max_size
+        self.__max_latency = max_latency
+        self.__prev = None
+
+    def __enter__(self):
+        self.__prev = self.__mdata._begin_batch(self.__max_size, self.__max_latency)
+        return self
+
+    def __exit__(self, exc_type, exc_val, traceback):
+        self.__mdata._end_batch(self.__prev)
+
+
 ##
 # Market data engine wrapper
 class MarketData(object):
@@ -526,27 +945,102 @@ class MarketData(object):
     def __on_symbol(symbol, ctx):
         pass
 
+    # proto type -> (wrapper class, pointer type, name of default handler)
+    __wrappers = {ProtoType.book: (Book, _book_ptr, "on_mdata_book"),
+                  ProtoType.trade: (Trade, _trade_ptr, "on_mdata_trade"),
+                  ProtoType.quote: (Quote, _quote_ptr, "on_mdata_quote"),
+                  ProtoType.common_info: (CommonInfo, _common_info_ptr, "on_mdata_common_info")}
+
+    # subscription type -> proto type
+    __mask_types = ((SubscriptionType.book, ProtoType.book),
+                    (SubscriptionType.trade, ProtoType.trade),
+                    (SubscriptionType.quote, ProtoType.quote),
+                    (SubscriptionType.common, ProtoType.common_info))
+
+    # types of market data, which can be conflated
+    __conflatable = (ProtoType.book, ProtoType.quote)
+
     @staticmethod
     def __on_mdata(md_type, mdata, ctx):
         self = ctypes.cast(ctx, ctypes.py_object).value
         if md_type == ProtoType.heartbeat:
             self.on_mdata_heartbeat()
-        elif md_type == ProtoType.book:
-            book = ctypes.cast(mdata, ctypes.POINTER(mdata_ctypes.Book_20CTypes))
-            instr = self.__instrdb.get_by_id(book.contents.instr_id)
-            self.on_mdata_book(Book(instr, book))
-        elif md_type == ProtoType.trade:
-            trade = ctypes.cast(mdata, ctypes.POINTER(mdata_ctypes.TradeCTypes))
-            instr = self.__instrdb.get_by_id(trade.contents.instr_id)
-            self.on_mdata_trade(Trade(instr, trade))
-        elif md_type == ProtoType.quote:
-            quote = ctypes.cast(mdata, ctypes.POINTER(mdata_ctypes.QuoteCTypes))
-            instr = self.__instrdb.get_by_id(quote.contents.instr_id)
-            self.on_mdata_quote(Quote(instr, quote))
-        elif md_type == ProtoType.common_info:
-            info = ctypes.cast(mdata, ctypes.POINTER(mdata_ctypes.CommonInfoCTypes))
-            instr = self.__instrdb.get_by_id(info.contents.instr_id)
-            self.on_mdata_common_info(CommonInfo(instr, info))
+            return
+        if not mdata:
+            return
+        if self.__recorder is not None:
+            self.__recorder.record(md_type, mdata)
+        batch = self.__batch.get(md_type)
+        if batch is not None:
+            batch.put(mdata)
+            if not self.__deliver_armed:
+                self.__arm_delivery()
+            return
+        # instr_id is the first field of all market data structures
+        instr_id = ctypes.c_ulong.from_address(mdata).value
+        key = (instr_id, md_type)
+        entry = self.__dispatch.get(key)
+        if entry is None:
+            entry = self.__add_dispatch(instr_id, md_type, mdata)
+            if entry is None:
+                return
+        handler, wrapper, addr, size = entry
+        if addr is None:
+            if self.__reuse:
+                wrapper._reset(mdata)
+                handler(wrapper)
+            else:
+                cls, ptr_type, _ = MarketData.__wrappers[md_type]
+                handler(cls(wrapper.instr, ctypes.cast(mdata, ptr_type)))
+        else:
+            ctypes.memmove(addr, mdata, size)
+            if key in self.__pending:
+                self.__conflated_cnt += 1
+            self.__pending[key] = entry
+            if not self.__deliver_armed:
+                self.__arm_delivery()
+
+    ##
+    # arm one-shot timer, which delivers conflated and batched data from node loop after current receive cycle
+    def __arm_delivery(self):
+        if self.__deliver_timer is None:
+            self.__deliver_timer = Timer(self.__on_deliver_timer)
+        self.__deliver_armed = True
+        self.__deliver_timer.start(1)
+
+    def __on_deliver_timer(self, timer):
+        timer.stop()
+        self.__deliver_armed = False
+        self.deliver_conflated()
+        self.deliver_batch()
+
+    ##
+    # create dispatch entry of instrument: cached instrument, wrapper and handler.
+    # wrapper of conflated data owns buffer, which latest data is copied to
+    # @param[in] instr_id - instrument id
+    # @param[in] md_type  - type of market data @see ProtoType
+    # @param[in] mdata    - pointer to market data
+    # @return (handler, wrapper, buffer address, buffer size) or None for unknown type of market data.
+    #         buffer address is None if market data is not conflated
+    def __add_dispatch(self, instr_id, md_type, mdata):
+        wrapper = MarketData.__wrappers.get(md_type)
+        if wrapper is None:
+            return None
+        cls, ptr_type, default = wrapper
+        instr = self.__instrdb.get_by_id(instr_id)
+        handler = self.__handlers.get((instr_id, md_type))
+        if handler is None:
+            handler = self.__handlers.get((0, md_type))
+        if handler is None:
+            handler = getattr(self, default)
+        conflate = self.__conflate.get(instr_id, self.__conflate.get(0, self.__conflate_default))
+        if conflate and md_type in MarketData.__conflatable:
+            data = ptr_type._type_()
+            entry = (handler, cls(instr, ctypes.pointer(data)), ctypes.addressof(data), ctypes.sizeof(data))
+        else:
+            entry = (handler, cls(instr, ctypes.cast(mdata, ptr_type)), None, 0)
+        self.__dispatch[(instr_id, md_type)] = entry
+        return entry
 
     @staticmethod
     def __on_resolve(subs, ctx):
@@ -597,8 +1091,41 @@ class MarketData(object):
     __instrdb = None
     __data = None
 
-    def __init__(self, config, instrdb):
+    ##
+    # @param[in] config  - mdata engine configuration @see Config
+    # @param[in] instrdb - @see InstrDB
+    # @param[in] reuse   - opt-in flyweight mode: if True one wrapper per instrument and type of market data is
+    #                      rebound to incoming data and passed to handlers, handlers should copy() it to keep data
+    #                      after return. if False each callback gets its own wrapper, conflated data is copied
+    def __init__(self, config, instrdb, reuse=False):
         self.__instrdb = instrdb
+        self.__reuse = reuse
+        self.__handlers = dict()  # (instr id or 0 for all instruments, proto type) -> handler
+        self.__deliver_timer = None  # one-shot timer, which delivers conflated and batched data
+        self.__deliver_armed = False
+        self.__dispatch = dict()  # (instr id, proto type) -> (handler, wrapper, buffer address, buffer size)
+        self.__conflate_default = config.has_attr("conflate") and config.get_attr_b("conflate")
+        self.__conflate = dict()  # instr id or 0 for all instruments -> conflate flag
+        self.__pending = dict()   # (instr id, proto type) -> dispatch entry of conflated data
+        self.__conflated_cnt = 0
+        self.__delivered_cnt = 0
+        self.__pub_size = config.get_attr_i("publish_batch_size") if config.has_attr("publish_batch_size") else 256
+        self.__pub_latency = (config.get_attr_i("publish_batch_latency_us") / 1e6
+                              if config.has_attr("publish_batch_latency_us") else 0.001)
+        self.__pub_batch = None  # (max size, max latency) while in batch scope
+        self.__pub_pending = 0
+        self.__pub_first_ts = 0
+        self.__pub_timer = None  # one-shot timer, which flushes batch after max latency
+        self.__pub_start_ts = None
+        self.__pub_msg_cnt = 0
+        self.__pub_flush_cnt = 0
+        self.__recorder = None
+        self.__batch = dict()  # proto type -> MdataBatch, empty if batch mode is off
+        if config.has_attr("batch") and config.get_attr_b("batch"):
+            capacity = config.get_attr_i("batch_size") if config.has_attr("batch_size") else 4096
+            self.__batch = {ProtoType.book: MdataBatch(mdata_ctypes.Book_20CTypes, capacity),
+                            ProtoType.quote: MdataBatch(mdata_ctypes.QuoteCTypes, capacity),
+                            ProtoType.trade: MdataBatch(mdata_ctypes.TradeCTypes, capacity)}
         self.__on_symbol_fun = mdata_ctypes.on_mdata_symbol_type(self.__on_symbol)
         self.__on_mdata_fun = mdata_ctypes.on_mdata_mdata_type(self.__on_mdata)
         self.__on_resolve_fun = mdata_ctypes.on_mdata_resolve_type(self.__on_resolve)
@@ -618,6 +1145,7 @@ class MarketData(object):
     def __del__(self):
         if self.__engine:
             lib.mdata_engine().mdata_engine_destroy(self.__engine)
+            self.__engine = None
 
     ##
     # initializes connect to source of market data
@@ -634,7 +1162,12 @@ class MarketData(object):
     # subscribes to the market data of specific instrument
     # @param [in] alias - alias of instr
     # @param [in] mask - subscription mask @see SubscriptionType
-    def subscribe(self, alias, mask):
+    # @param [in] handler - callable(data) called instead of on_mdata_book/trade/quote/common_info
+    #                       for types in mask. data wrapper is reused between calls in reuse mode
+    # @param [in] conflate - if True only latest book and quote of instrument are delivered by deliver_conflated(),
+    #                        trades and common info are delivered in full. if None "conflate" attribute of
+    #                        mdata_engine config is used
+    def subscribe(self, alias, mask, handler=None, conflate=None):
         cback = mdata_ctypes.ChannelCallbackCTypes(ctypes.py_object(self), self.__on_mdata_fun)
         if alias is not None:
             instr = self.__instrdb.get_by_alias(alias)
@@ -650,15 +1183,246 @@ class MarketData(object):
             raise RuntimeError("mdata_channel is unable to subscribe "
                                "to instrument with alias {0}. error = {1}".format(alias, res))
 
+        if handler is not None or conflate is not None:
+            instr_id = 0 if instr is None else instr.id
+            if handler is not None:
+                for sub_type, md_type in MarketData.__mask_types:
+                    if mask & sub_type:
+                        self.__handlers[(instr_id, md_type)] = handler
+            if conflate is not None:
+                self.__conflate[instr_id] = conflate
+            if instr is None:
+                self.__dispatch.clear()
+            else:
+                for _, md_type in MarketData.__mask_types:
+                    self.__dispatch.pop((instr_id, md_type), None)
+
+    ##
+    # process market data as received from engine, e.g. in replay
+    # @param[in] md_type - type of market data @see ProtoType
+    # @param[in] mdata   - address of market data
+    def process_mdata(self, md_type, mdata):
+        MarketData.__on_mdata(md_type, mdata, id(self))
+
+    ##
+    # record all received market data
+    # @param[in] recorder - @see journal.Recorder, None to detach
+    def attach_recorder(self, recorder):
+        self.__recorder = recorder
+
+    ##
+    # deliver latest conflated books and quotes to handlers. It is called by timer in node loop after receive
+    # cycle, in which data was conflated, so any receive loop gets data. Call it explicitly to deliver at once,
+    # e.g. Robot.receive does it after each receive cycle, Replay after each cycle of records
+    def deliver_conflated(self):
+        if not self.__pending:
+            return
+        pending = self.__pending
+        self.__pending = dict()
+        self.__delivered_cnt += len(pending)
+        for handler, wrapper, _, _ in pending.values():
+            handler(wrapper if self.__reuse else wrapper.copy())
+
+    ##
+    # deliver books, quotes and trades collected in batch mode to on_mdata_batch. It is called by timer in node
+    # loop after receive cycle, in which data was collected, and can be called explicitly as deliver_conflated
+    def deliver_batch(self):
+        if not self.__batch:
+            return
+        books = self.__batch[ProtoType.book]
+        quotes = self.__batch[ProtoType.quote]
+        trades = self.__batch[ProtoType.trade]
+        if books or quotes or trades:
+            try:
+                self.on_mdata_batch(books.records, quotes.records, trades.records)
+            finally:
+                books.clear()
+                quotes.clear()
+                trades.clear()
+
+    ##
+    # conflation statistic
+    # @return dict with counts of conflated (dropped) and delivered updates, and updates waiting for delivery
+    @property
+    def conflation_statistic(self):
+        return {"conflated": self.__conflated_cnt, "delivered": self.__delivered_cnt,
+                "pending": len(self.__pending)}
+
+    ##
+    # drop dispatch entries, instruments and wrappers are resolved again on next market data
+    def reset_dispatch(self):
+        self.__dispatch.clear()
+
     def send(self, mdtype, data):
         """
-        sends data to stream
+        sends data to stream. inside batch() scope data is put to batch
         :param mdtype - type of mdata @see class ProtoType
-        :param data -
+        :param data - ctypes pointer to data
 
         """
-        if self.__engine:
+        if self.__pub_batch is not None:
+            self.put(mdtype, data)
+        elif self.__engine:
             lib.mdata_engine().mdata_engine_send(self.__engine, mdtype, data)
+            self.__count_published(1)
+
+    ##
+    # put data to batch of published data. batch is flushed when it reaches max size or its first
+    # data waits longer than max latency: one-shot timer armed by first data of batch flushes it from
+    # node loop. out of batch() scope call flush() to publish the rest of batch
+    # @param[in] mdtype - type of mdata @see ProtoType
+    # @param[in] data   - ctypes pointer to data
+    def put(self, mdtype, data):
+        if not self.__engine:
+            return
+        res = lib.mdata_engine().mdata_engine_put(self.__engine, mdtype, data, ctypes.sizeof(data._type_))
+        if res != 0:
+            raise RuntimeError("unable to put market data, error = {0}".format(res))
+        max_size, max_latency = self.__pub_batch or (self.__pub_size, self.__pub_latency)
+        first = not self.__pub_pending
+        if first:
+            self.__pub_first_ts = time.monotonic()
+        self.__pub_pending += 1
+        if self.__pub_pending >= max_size or time.monotonic() - self.__pub_first_ts >= max_latency:
+            self.flush()
+        elif first:
+            if self.__pub_timer is None:
+                self.__pub_timer = Timer(self.__on_pub_timer)
+            self.__pub_timer.start(max(1, int(max_latency * 1e6)))
+
+    def __on_pub_timer(self, timer):
+        timer.stop()
+        self.flush()
+
+    ##
+    # publish data put to batch
+    def flush(self):
+        if not self.__pub_pending or not self.__engine:
+            return
+        if self.__pub_timer is not None and self.__pub_timer.started:
+            self.__pub_timer.stop()
+        res = lib.mdata_engine().mdata_engine_flush(self.__engine)
+        self.__count_published(self.__pub_pending)
+        self.__pub_flush_cnt += 1
+        self.__pub_pending = 0
+        if res != 0:
+            raise RuntimeError("unable to flush market data, error = {0}".format(res))
+
+    ##
+    # put list of data to batch and flush it
+    # @param[in] records - iterable of Book, Quote, Trade, CommonInfo or (mdtype, ctypes pointer)
+    def put_many(self, records):
+        with self.batch():
+            for rec in records:
+                if isinstance(rec, tuple):
+                    self.put(*rec)
+                else:
+                    rec.send(self)
+
+    ##
+    # scope, where send() puts data to batch. batch is flushed on exit
+    # @param[in] max_size    - max count of data in batch, "publish_batch_size" config attribute if None
+    # @param[in] max_latency - max wait of data in batch, seconds, "publish_batch_latency_us" config attribute
+    #                          if None
+    # @return @see PublishBatch
+    def batch(self, max_size=None, max_latency=None):
+        return PublishBatch(self,
+                            self.__pub_size if max_size is None else max_size,
+                            self.__pub_latency if max_latency is None else max_latency)
+
+    def _begin_batch(self, max_size, max_latency):
+        prev = self.__pub_batch
+        self.__pub_batch = (max_size, max_latency)
+        return prev
+
+    def _end_batch(self, prev):
+        self.__pub_batch = prev
+        if prev is None:
+            self.flush()
+
+    def __count_published(self, count):
+        if self.__pub_start_ts is None:
+            self.__pub_start_ts = time.monotonic()
+        self.__pub_msg_cnt += count
+
+    ##
+    # resolve instrument and its id
+    # @param[in] instr - instrument or its id
+    # @return (instrument, id)
+    def __instr(self, instr):
+        if hasattr(instr, "ptr"):
+            return instr, instr.id
+        return self.__instrdb.get_by_id(instr), instr
+
+    ##
+    # gets last book of instrument kept by engine
+    # @param[in] instr - instrument or its id
+    # @return @see Book, zero-copy view which is updated by engine, or None if no book received yet
+    def get_book(self, instr):
+        instr, instr_id = self.__instr(instr)
+        book = lib.mdata_engine().mdata_engine_get_book(self.__engine, instr_id)
+        if book:
+            return Book(instr, ctypes.cast(book, _book_ptr))
+        return None
+
+    ##
+    # gets last quote of instrument kept by engine
+    # @param[in] instr - instrument or its id
+    # @return @see Quote, zero-copy view which is updated by engine, or None if no quote received yet
+    def get_last_quote(self, instr):
+        instr, instr_id = self.__instr(instr)
+        quote = lib.mdata_engine().mdata_engine_get_quote(self.__engine, instr_id)
+        if quote:
+            return Quote(instr, ctypes.cast(quote, _quote_ptr))
+        return None
+
+    ##
+    # gets last trade of instrument kept by engine
+    # @param[in] instr - instrument or its id
+    # @return @see Trade, zero-copy view which is updated by engine, or None if no trade received yet
+    def get_last_trade(self, instr):
+        instr, instr_id = self.__instr(instr)
+        trade = lib.mdata_engine().mdata_engine_get_trade(self.__engine, instr_id)
+        if trade:
+            return Trade(instr, ctypes.cast(trade, _trade_ptr))
+        return None
+
+    ##
+    # copy last quotes of instruments into numpy structured array, requires numpy
+    # mdata_engine has no bulk call, it is one mdata_engine_get_quote call per instrument,
+    # saving is in building no Quote wrappers only
+    # @param[in] instrs - instruments or their ids
+    # @param[in] out    - array of QuoteCTypes dtype and len(instrs) size to fill, allocated if None
+    # @return array ordered as instrs, rows of instruments without quote are zeroed
+    def get_last_quotes(self, instrs, out=None):
+        import numpy
+        ids = [i.id if hasattr(i, "ptr") else i for i in instrs]
+        if out is None:
+            out = numpy.zeros(len(ids), numpy.dtype(mdata_ctypes.QuoteCTypes))
+        elif out.dtype.itemsize != ctypes.sizeof(mdata_ctypes.QuoteCTypes) or len(out) < len(ids):
+            raise TypeError("out must be array of QuoteCTypes of size {0} at least".format(len(ids)))
+        get_quote = lib.mdata_engine().mdata_engine_get_quote
+        size = ctypes.sizeof(mdata_ctypes.QuoteCTypes)
+        addr = out.ctypes.data
+        engine = self.__engine
+        for n, instr_id in enumerate(ids):
+            quote = get_quote(engine, instr_id)
+            if quote:
+                ctypes.memmove(addr + n * size, quote, size)
+            else:
+                ctypes.memset(addr + n * size, 0, size)
+        return out
+
+    ##
+    # publishing statistic
+    # @return dict with counts of published messages and flushes, mean batch size and messages per second
+    @property
+    def publish_statistic(self):
+        elapsed = 0 if self.__pub_start_ts is None else time.monotonic() - self.__pub_start_ts
+        return {"messages": self.__pub_msg_cnt, "flushes": self.__pub_flush_cnt,
+                "pending": self.__pub_pending,
+                "batch_mean": self.__pub_msg_cnt / self.__pub_flush_cnt if self.__pub_flush_cnt else 0,
+                "rate": self.__pub_msg_cnt / elapsed if elapsed else 0}
 
     def on_mdata_resolve(self, alias):
         """
@@ -711,6 +1475,16 @@ class MarketData(object):
         :return:
         """
 
+    def on_mdata_batch(self, books, quotes, trades):
+        """
+        Callback on market data collected during receive cycle, when "batch" attribute of mdata_engine
+        config is set. Arrays are numpy views over reused buffers, valid till the end of callback
+        :param books: numpy structured array of Book_20CTypes records
+        :param quotes: numpy structured array of QuoteCTypes records
+        :param trades: numpy structured array of TradeCTypes records
+        :return:
+        """
+
     def on_mdata_heartbeat(self):
         """
 
@@ -111,6 +111,8 @@ on_mdata_feed_state_type = ctypes.CFUNCTYPE(None, ctypes.POINTER(FeedStateCTypes
 on_mdata_mdata_type = ctypes.CFUNCTYPE(None, ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
 on_mdata_connected_type = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
 on_mdata_disconnected_type = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+on_book_level_type = ctypes.CFUNCTYPE(None, ctypes.c_int32, ctypes.c_int, ctypes.c_double, ctypes.c_int64,
+                                      ctypes.c_void_p)
 
 class ServerCallbackCTypes(ctypes.Structure):
     _fields_ = [("ctx", ctypes.py_object),
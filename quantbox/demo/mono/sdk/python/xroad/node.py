@@ -8,6 +8,7 @@ import xroad.objects as objects
 import xroad.xtypes as xtypes
 import xroad.config as config
 import xroad.lib as lib
+import xroad.index as index
 
 
 ##
@@ -19,6 +20,32 @@ class NodeStatus(IntEnum):
     inactive = 4
 
 
+##
+# @class chunk of cursor objects, objects are wrapped on access
+class CursorChunk(object):
+
+    def __init__(self, ptrs, factory):
+        self.__ptrs = ptrs
+        self.__factory = factory
+
+    def __len__(self):
+        return len(self.__ptrs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CursorChunk(self.__ptrs[index], self.__factory)
+        return self.__factory(self.__ptrs[index])
+
+    def __iter__(self):
+        return map(self.__factory, self.__ptrs)
+
+    ##
+    # raw pointers of chunk objects
+    @property
+    def pointers(self):
+        return self.__ptrs
+
+
 ##
 # @class represents cursor which is used to iterate over objects in cache
 class NodeCursor(object):
@@ -27,6 +54,7 @@ class NodeCursor(object):
         self.__ptr = lib.node().xroad_node_create_cursor(obj_type.value)
         if self.__ptr is None:
             raise RuntimeError("unable to create cursor of type '{0}'".format(obj_type.name))
+        self.__type = obj_type
         self.__offset = offset
 
     def __del__(self):
@@ -45,37 +73,129 @@ class NodeCursor(object):
     # @return object  from cache
     @property
     def objects(self):
+        wrap = objects.object_factory(self.__type)
+        get_next = lib.node().xroad_node_cursor_get_next
         obj = lib.node().xroad_node_cursor_get_first(self.__ptr)
         if self.__offset:
             obj = lib.node().xroad_node_cursor_offset(self.__ptr, self.__offset)
         while obj:
-            yield objects.ptr_to_object(obj, False)
+            yield wrap(obj)
+            obj = get_next(self.__ptr)
+
+    ##
+    # return objects from cache by chunks, python side batching helper: libnode has no multi-row fetch, so each
+    # pointer is still fetched by one xroad_node_cursor_get_next call. chunks only group pointers for consumers,
+    # which process objects in batches, and defer wrapping to access
+    # @param[in] size - max count of objects in chunk
+    # @param[in] wrap - if False chunks are lists of raw object pointers
+    # @return @see CursorChunk or list of pointers
+    def chunks(self, size=1024, wrap=True):
+        factory = objects.object_factory(self.__type)
+        get_next = lib.node().xroad_node_cursor_get_next
+        obj = lib.node().xroad_node_cursor_get_first(self.__ptr)
+        if self.__offset:
+            obj = lib.node().xroad_node_cursor_offset(self.__ptr, self.__offset)
+        cur = self.__ptr
+        while obj:
+            chunk = []
+            append = chunk.append
+            while obj and len(chunk) < size:
+                append(obj)
+                obj = get_next(cur)
+            yield CursorChunk(chunk, factory) if wrap else chunk
+
+    ##
+    # return raw pointers to objects from cache, e.g. for objects.to_dict_many
+    # @return object pointer
+    @property
+    def pointers(self):
+        obj = lib.node().xroad_node_cursor_get_first(self.__ptr)
+        if self.__offset:
+            obj = lib.node().xroad_node_cursor_offset(self.__ptr, self.__offset)
+        while obj:
+            yield obj
             obj = lib.node().xroad_node_cursor_get_next(self.__ptr)
 
+    ##
+    # export objects from cache into numpy masked structured array, requires numpy
+    # @param[in] fields - names of fields to export, "id" included. all fields if None
+    # @return numpy.ma.MaskedArray, unset fields are masked. @see objects.to_numpy
+    def to_numpy(self, fields=None):
+        count = lib.node().xroad_node_get_object_count(self.__type)
+        return objects.to_numpy(self.pointers, self.__type, fields, count)
+
     ##
     # return objects from cache
     # @return object  from cache
     @property
     def objects_with_last_flag(self):
+        wrap = objects.object_factory(self.__type)
+        get_next = lib.node().xroad_node_cursor_get_next
         obj = lib.node().xroad_node_cursor_get_first(self.__ptr)
         if self.__offset:
             obj = lib.node().xroad_node_cursor_offset(self.__ptr, self.__offset)
         while obj:
             tmp = obj
-            obj = lib.node().xroad_node_cursor_get_next(self.__ptr)
-            yield objects.ptr_to_object(tmp, False), obj is None
+            obj = get_next(self.__ptr)
+            yield wrap(tmp), obj is None
 
     ##
     # return objects from cache in reverse order
     # @return object from cache
     @property
     def robjects(self):
+        wrap = objects.object_factory(self.__type)
+        get_prev = lib.node().xroad_node_cursor_get_prev
         obj = lib.node().xroad_node_cursor_get_last(self.__ptr)
         if self.__offset:
-            obj = lib.node().xroad_node_cursor_offset(-self.__offset)
+            obj = lib.node().xroad_node_cursor_offset(self.__ptr, -self.__offset)
+        while obj:
+            yield wrap(obj)
+            obj = get_prev(self.__ptr)
+
+    ##
+    # return last n objects from cache in direct order, without scanning from the head
+    # @param[in] n - count of objects
+    # @return object from cache
+    def tail(self, n):
+        count = lib.node().xroad_node_get_object_count(self.__type)
+        return self.range(max(count - n, 0), count)
+
+    ##
+    # return objects from cache by positions, as range(start, stop, step) does.
+    # negative positions count from the tail. cursor is positioned from the nearest end of cache
+    # @param[in] start - position of first object
+    # @param[in] stop  - position to stop at, end of cache if None
+    # @param[in] step  - step between positions, can be negative
+    # @return object from cache
+    def range(self, start, stop=None, step=1):
+        count = lib.node().xroad_node_get_object_count(self.__type)
+        start, stop, step = slice(start, stop, step).indices(count)
+        total = len(range(start, stop, step))
+        if not total:
+            return
+        wrap = objects.object_factory(self.__type)
+        offset = lib.node().xroad_node_cursor_offset
+        if step == 1:
+            move = lib.node().xroad_node_cursor_get_next
+        elif step == -1:
+            move = lib.node().xroad_node_cursor_get_prev
+        else:
+            move = lambda cursor: offset(cursor, step)
+        if start < count // 2:
+            obj = lib.node().xroad_node_cursor_get_first(self.__ptr)
+            if start:
+                obj = offset(self.__ptr, start)
+        else:
+            obj = lib.node().xroad_node_cursor_get_last(self.__ptr)
+            if start != count - 1:
+                obj = offset(self.__ptr, start - count + 1)
         while obj:
-            yield objects.ptr_to_object(obj, False)
-            obj = lib.node().xroad_node_cursor_get_prev(self.__ptr)
+            yield wrap(obj)
+            total -= 1
+            if not total:
+                break
+            obj = move(self.__ptr)
 
 on_object_handler = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_ushort, ctypes.c_void_p)
 
@@ -88,7 +208,12 @@ class Node(object):
     def __on_object(obj, node_id, ctx):
         self = ctypes.cast(ctx, ctypes.py_object).value
         self.data.statistic.msg_in_cnt += 1
-        self.on_node_object(objects.ptr_to_object(obj), node_id)
+        obj = objects.ptr_to_object(obj)
+        indexes = self.__indexes.get(obj.object_type)
+        if indexes:
+            for idx in indexes:
+                idx.update(obj)
+        self.on_node_object(obj, node_id)
 
     @staticmethod
     def __on_signal(signal_ptr, signal, ctx):
@@ -106,6 +231,7 @@ class Node(object):
 
     def __init__(self, name, out_of_system=False):
         self.__reg = registry.Registry(out_of_system)
+        self.__indexes = dict()  # object type -> list of ObjectIndex
         self.__on_object_fun = on_object_handler(Node.__on_object)
         self.__on_signal_fun = lib.on_signal_handler(Node.__on_signal)
         cback = Node.NodeCallbackCTypes(ctypes.py_object(self), self.__on_object_fun)
@@ -213,6 +339,48 @@ class Node(object):
         if obj:
             return objects.ptr_to_object(obj, False)
 
+    ##
+    # create secondary index over cache objects. index is filled from cache and then
+    # updated by each received object of indexed type
+    # @param[in] obj_type - type of objects
+    # @param[in] field    - name of indexed field
+    # @return @see index.ObjectIndex
+    def create_index(self, obj_type, field):
+        idx = self.get_index(obj_type, field)
+        if idx is None:
+            idx = index.ObjectIndex(obj_type, field)
+            idx.rebuild()
+            self.__indexes.setdefault(idx.object_type, []).append(idx)
+        return idx
+
+    ##
+    # return secondary index
+    # @param[in] obj_type - type of objects
+    # @param[in] field    - name of indexed field
+    # @return @see index.ObjectIndex or None
+    def get_index(self, obj_type, field):
+        for idx in self.__indexes.get(objects.ObjectType(obj_type), ()):
+            if idx.field == field:
+                return idx
+
+    ##
+    # drop secondary index
+    # @param[in] obj_type - type of objects
+    # @param[in] field    - name of indexed field
+    def drop_index(self, obj_type, field):
+        idx = self.get_index(obj_type, field)
+        if idx is not None:
+            self.__indexes[idx.object_type].remove(idx)
+
+    ##
+    # return objects from cache by value of indexed field, index is created on first call
+    # @param[in] obj_type - type of objects
+    # @param[in] field    - name of indexed field
+    # @param[in] key      - field value
+    # @return list of objects
+    def find_objects(self, obj_type, field, key):
+        return self.create_index(obj_type, field).find(key)
+
     ##
     # create new cache cursor
     # @param[in] type - type of cursor
@@ -3,11 +3,15 @@
 # @author Dmitry S. Melnikov, dmitryme@gmail.com
 
 import ctypes
+import logging
+import time
+from collections import deque
 from enum import IntEnum
 from xroad.order_ctypes import *
 from xroad.xtypes import Str, Errno, RejReason
 import xroad.objects as xobj
 import xroad.lib as lib
+from xroad.common import Timer
 
 
 class State(IntEnum):
@@ -27,6 +31,15 @@ class State(IntEnum):
 class ReplaceMask(IntEnum):
     qty = 1
     price = 2
+    ext_ref = 4
+
+
+##
+# priority of outbound action, less is sent first
+class Priority(IntEnum):
+    cancel = 0
+    replace = 1
+    new = 2
 
 
 class OrderOption(IntEnum):
@@ -34,15 +47,73 @@ class OrderOption(IntEnum):
     cancel_timeout_ms = 2
 
 
+_states = tuple(State)  # order_state_t -> State without building enum
+_active_states = frozenset((State.active, State.awaiting_active, State.awaiting_replace, State.awaiting_cancel,
+                            State.awaiting_destroy))
+
+
+##
+# @class order of liborder. State, quantities and prices are read from snapshot, which is refreshed by
+# OrderPool callbacks and after order actions, so reads do not call liborder
 class Order(object):
 
-    def __init__(self, pool, name, cback, instr, acc, client_code, side, qty, price, ext_ref):
+    __slots__ = ("__order", "__pool", "__name", "__instr", "__instr_id", "__side", "__acc", "__debug", "__state",
+                 "__qty", "__leaves_qty", "__price", "__total_qty", "__avg_price")
+
+    ##
+    # @param[in] debug - compare snapshot with liborder on each refresh @see _verify
+    def __init__(self, pool, name, cback, instr, acc, client_code, side, qty, price, ext_ref, debug=False):
         err = Str()
         self.__order = lib.order().order_create(
             Str(name), cback, instr.ptr, Str(acc), Str(client_code),
             side, qty, price, Str(ext_ref), ctypes.py_object(pool), ctypes.pointer(err))
         if not self.__order:
             raise RuntimeError("unable to create order. reason = {0}".format(err))
+        self.__pool = pool
+        self.__name = name
+        self.__instr = instr
+        self.__instr_id = instr.id
+        self.__side = side
+        self.__acc = acc
+        self.__debug = debug
+        self._refresh(fill=True, params=True)
+
+    ##
+    # refresh snapshot of state and leaves qty from liborder
+    # @param[in] fill   - refresh total qty and average price too
+    # @param[in] params - refresh qty and price too
+    def _refresh(self, fill=False, params=False):
+        order = lib.order()
+        ptr = self.__order
+        self.__state = _states[order.order_get_state(ptr)]
+        self.__leaves_qty = order.order_get_leaves_qty(ptr)
+        if fill:
+            self.__total_qty = order.order_get_total_qty(ptr)
+            self.__avg_price = order.order_get_avg_price(ptr)
+        if params:
+            self.__qty = order.order_get_qty(ptr)
+            self.__price = order.order_get_price(ptr)
+        if self.__debug:
+            self._verify()
+
+    ##
+    # compare snapshot with liborder
+    # @exception RuntimeError - snapshot differs from liborder
+    def _verify(self):
+        order = lib.order()
+        ptr = self.__order
+        native = (_states[order.order_get_state(ptr)], order.order_get_qty(ptr), order.order_get_leaves_qty(ptr),
+                  order.order_get_price(ptr), order.order_get_total_qty(ptr), order.order_get_avg_price(ptr))
+        snapshot = (self.__state, self.__qty, self.__leaves_qty, self.__price, self.__total_qty, self.__avg_price)
+        if native != snapshot:
+            raise RuntimeError("order '{0}' snapshot {1} differs from liborder {2}".format(
+                self.__name, snapshot, native))
+
+    ##
+    # get pointer to native order
+    @property
+    def ptr(self):
+        return self.__order
 
     ##
     # set order option
@@ -63,39 +134,75 @@ class Order(object):
     # checks if order is active
     @property
     def is_active(self):
-        return (self.state == State.active or
-                self.state == State.awaiting_active or
-                self.state == State.awaiting_replace or
-                self.state == State.awaiting_cancel or
-                self.state == State.awaiting_destroy)
+        return self.__state in _active_states
 
     ##
     # delete order
     # @param[in] order - order to delete
     def destroy(self, force=False):
-        lib.order().order_destroy(self.__order, 1 if force else 0)
+        self._destroy(force)
 
     ##
-    # send order to exchange
+    # delete order
+    # @return error code of liborder
+    def _destroy(self, force=False):
+        res = lib.order().order_destroy(self.__order, 1 if force else 0)
+        if self.__state != State.destroyed:  # else on_destroyed has refreshed it and liborder may free order
+            self._refresh()
+        return res
+
+    ##
+    # send order to exchange, through scheduler of pool if it is attached @see OrderPool.attach_scheduler
     def send(self):
-        res = lib.order().order_send(self.__order)
+        scheduler = self.__pool._scheduler
+        res = self._send() if scheduler is None else scheduler.send(self)
         if res != Errno.ok:
             raise RuntimeError("unable to send order")
 
     ##
-    # cancel order on exchange
+    # send order to exchange
+    # @return error code of liborder
+    def _send(self):
+        res = lib.order().order_send(self.__order)
+        self._refresh()
+        return res
+
+    ##
+    # cancel order on exchange, through scheduler of pool if it is attached @see OutboundScheduler.cancel
     def cancel(self):
-        if self.is_active:
-            res = lib.order().order_cancel(self.__order)
+        scheduler = self.__pool._scheduler
+        if scheduler is not None or self.is_active:
+            res = self._cancel() if scheduler is None else scheduler.cancel(self)
             if res != Errno.ok:
-                raise RuntimeError("unable to send order {0}. error = {1}".format(self.state. Errno(res).name))
+                raise RuntimeError("unable to send order {0}. error = {1}".format(self.state, Errno(res).name))
 
     ##
-    # replace order
+    # cancel order on exchange
+    # @return error code of liborder
+    def _cancel(self):
+        res = lib.order().order_cancel(self.__order)
+        self._refresh()
+        return res
+
+    ##
+    # replace order, through scheduler of pool if it is attached
     # @param[in] qty - new order qty
     # @param[in] price - new order price
     # @param[in] ext_ref - order ext_ref
     def replace(self, qty=None, price=None, ext_ref=None):
+        scheduler = self.__pool._scheduler
+        if scheduler is None:
+            res = self._replace(qty, price, ext_ref)
+        else:
+            res = scheduler.replace(self, qty, price, ext_ref)
+        if res != Errno.ok:
+            raise RuntimeError("unable to replace order. error = {0}".format(Errno(res).name))
+
+    ##
+    # replace order
+    # @return error code of liborder
+    def _replace(self, qty=None, price=None, ext_ref=None):
+        res = Errno.ok
         mask = 0
         if qty is not None:
             mask |= ReplaceMask.qty
@@ -109,56 +216,74 @@ class Order(object):
             mask |= ReplaceMask.ext_ref
         if mask:
             res = lib.order().order_replace(self.__order, qty, price, Str(ext_ref), mask)
-        if res != Errno.ok:
-            raise RuntimeError("unable to replace order. error = {0}".format(Errno(res).name))
+            self._refresh()
+        return res
 
     ##
     # get order name
     @property
     def name(self):
-        return str(lib.order().order_get_name(self.__order))
+        return self.__name
 
     ##
     # get order state
     @property
     def state(self):
-        return State(lib.order().order_get_state(self.__order))
+        return self.__state
 
     ##
     # get order instrument
     @property
     def instr(self):
-        return xobj.Instr(lib.order().xroad_order_get_instr(self.__order))
+        return self.__instr
+
+    ##
+    # get id of order instrument
+    @property
+    def instr_id(self):
+        return self.__instr_id
+
+    ##
+    # get order side
+    @property
+    def side(self):
+        return self.__side
+
+    ##
+    # get order account
+    @property
+    def acc(self):
+        return self.__acc
 
     ##
     # get order quantity
     @property
     def qty(self):
-        return lib.order().order_get_qty(self.__order)
+        return self.__qty
 
     ##
     # get order leaves quantity
     @property
     def leaves_qty(self):
-        return lib.order().order_get_leaves_qty(self.__order)
+        return self.__leaves_qty
 
     ##
     # get order price
     @property
     def price(self):
-        return lib.order().order_get_price(self.__order)
+        return self.__price
 
     ##
     # get order total_qty
     @property
     def total_qty(self):
-        return lib.order().order_get_total_qty(self.__order)
+        return self.__total_qty
 
     ##
     # get order average price
     @property
     def avg_price(self):
-        return lib.order().order_get_avg_price(self.__order)
+        return self.__avg_price
 
     ##
     # get xroad_order
@@ -169,86 +294,116 @@ class Order(object):
 
 class OrderPool(object):
 
-    @staticmethod
-    def get_order_from_ctx(obj):
-        name = lib.order().order_get_name(obj)
-        ctx = lib.order().order_get_ctx(obj)
-        self = ctypes.cast(ctx, ctypes.py_object).value
-        return (self.get_order(str(name)), self)
-
-    @staticmethod
-    def __on_activate(obj):
-        order, self = OrderPool.get_order_from_ctx(obj)
+    def __on_activate(self, obj):
+        order = self.__registered.get(obj)
+        if order is None:
+            return
+        order._refresh()
         self.on_order_activate(order)
 
-    @staticmethod
-    def __on_before_send(obj):
-        order, self = OrderPool.get_order_from_ctx(obj)
+    def __on_before_send(self, obj):
+        order = self.__registered.get(obj)
+        if order is None:
+            return
+        order._refresh()
         self.on_before_send(order)
 
-    @staticmethod
-    def __on_trade(obj, qty, price):
-        order, self = OrderPool.get_order_from_ctx(obj)
+    def __on_trade(self, obj, qty, price):
+        order = self.__registered.get(obj)
+        if order is None:
+            return
+        order._refresh(fill=True)
         self.on_order_trade(order, qty, price)
 
-    @staticmethod
-    def __on_canceled(obj):
-        order, self = OrderPool.get_order_from_ctx(obj)
+    def __on_canceled(self, obj):
+        order = self.__registered.get(obj)
+        if order is None:
+            return
+        order._refresh()
         self.on_order_canceled(order)
 
-    @staticmethod
-    def __on_unexpected_canceled(obj):
-        order, self = OrderPool.get_order_from_ctx(obj)
+    def __on_unexpected_canceled(self, obj):
+        order = self.__registered.get(obj)
+        if order is None:
+            return
+        order._refresh()
         self.on_order_unexpected_canceled(order)
 
-    @staticmethod
-    def __on_expired(obj):
-        order, self = OrderPool.get_order_from_ctx(obj)
+    def __on_expired(self, obj):
+        order = self.__registered.get(obj)
+        if order is None:
+            return
+        order._refresh()
         self.on_order_expired(order)
 
-    @staticmethod
-    def __on_destroyed(obj):
-        order, self = OrderPool.get_order_from_ctx(obj)
+    def __on_destroyed(self, obj):
+        order = self.__registered.get(obj)
+        if order is None:
+            return
+        order._refresh()
         self.on_order_destroyed(order)
-        del self.__orders[order.name]
-
-    @staticmethod
-    def __on_replaced(obj):
-        order, self = OrderPool.get_order_from_ctx(obj)
+        del self.__registered[obj]
+        self._remove_order(order.name)
+
+    def __on_replaced(self, obj):
+        order = self.__registered.get(obj)
+        if order is None:
+            return
+        order._refresh(params=True)
+        self._on_replace_done(order)
         self.on_order_replaced(order)
 
-    @staticmethod
-    def __on_rejected(obj, err_code, err_txt):
-        order, self = OrderPool.get_order_from_ctx(obj)
+    def __on_rejected(self, obj, err_code, err_txt):
+        order = self.__registered.get(obj)
+        if order is None:
+            return
+        order._refresh()
         self.on_order_rejected(order, RejReason(err_code), str(err_txt))
 
-    @staticmethod
-    def __on_cancel_rejected(obj, err_code, err_txt):
-        order, self = OrderPool.get_order_from_ctx(obj)
+    def __on_cancel_rejected(self, obj, err_code, err_txt):
+        order = self.__registered.get(obj)
+        if order is None:
+            return
+        order._refresh()
         self.on_order_cancel_rejected(order, RejReason(err_code), str(err_txt))
 
-    @staticmethod
-    def __on_replace_rejected(obj, err_code, err_txt):
-        order, self = OrderPool.get_order_from_ctx(obj)
+    def __on_replace_rejected(self, obj, err_code, err_txt):
+        order = self.__registered.get(obj)
+        if order is None:
+            return
+        order._refresh()
+        self._on_replace_done(order)
         self.on_order_replace_rejected(order, RejReason(err_code), str(err_txt))
 
     ##
     # create order pool
     # @param[in] instrdb - instrdb instance
-    def __init__(self, instrdb):
+    # @param[in] debug    - check snapshots of orders against liborder on each refresh
+    # @param[in] coalesce - keep only the latest replace_order of order, which awaits replace, and send it
+    #                       when the pending replace is done
+    def __init__(self, instrdb, debug=False, coalesce=False):
         self.__orders = dict()
+        # order_t* -> order of orders created by liborder, callbacks find order by it without FFI calls
+        self.__registered = dict()
+        self.__coalesce = coalesce
+        self.__replaces = dict()  # name -> [qty, price, ext_ref] of coalesced replace
+        self.__replace_stat = {"requested": 0, "sent": 0}
+        self.__by_instr = dict()  # instr_id -> {name: order}
+        self.__debug = debug
         self.__instrdb = instrdb
-        self.__on_activate_fun = on_activate(OrderPool.__on_activate)
-        self.__on_before_send_fun = on_before_send(OrderPool.__on_before_send)
-        self.__on_trade_fun = on_trade(OrderPool.__on_trade)
-        self.__on_canceled_fun = on_canceled(OrderPool.__on_canceled)
-        self.__on_unexpected_canceled_fun = on_unexpected_canceled(OrderPool.__on_unexpected_canceled)
-        self.__on_expired_fun = on_expired(OrderPool.__on_expired)
-        self.__on_destroyed_fun = on_destroyed(OrderPool.__on_destroyed)
-        self.__on_replaced_fun = on_replaced(OrderPool.__on_replaced)
-        self.__on_rejected_fun = on_rejected(OrderPool.__on_rejected)
-        self.__on_cancel_rejected_fun = on_cancel_rejected(OrderPool.__on_cancel_rejected)
-        self.__on_replace_rejected_fun = on_replace_rejected(OrderPool.__on_replace_rejected)
+        self.__simulator = None
+        self.__scheduler = None
+        self.__on_activate_fun = on_activate(self.__on_activate)
+        self.__on_before_send_fun = on_before_send(self.__on_before_send)
+        self.__on_trade_fun = on_trade(self.__on_trade)
+        self.__on_canceled_fun = on_canceled(self.__on_canceled)
+        self.__on_unexpected_canceled_fun = on_unexpected_canceled(self.__on_unexpected_canceled)
+        self.__on_expired_fun = on_expired(self.__on_expired)
+        self.__on_destroyed_fun = on_destroyed(self.__on_destroyed)
+        self.__on_replaced_fun = on_replaced(self.__on_replaced)
+        self.__on_rejected_fun = on_rejected(self.__on_rejected)
+        self.__on_cancel_rejected_fun = on_cancel_rejected(self.__on_cancel_rejected)
+        self.__on_replace_rejected_fun = on_replace_rejected(self.__on_replace_rejected)
         self.__cback = OrderCallbackCTypes(
             self.__on_activate_fun,
             self.__on_before_send_fun,
@@ -273,14 +428,123 @@ class OrderPool(object):
     # @param[in] price        - order price
     # @param[in] ext_ref      - order external reference data
     # @return order instance
+    # @exception RuntimeError - order with the same name exists, till its on_order_destroyed
     def create_order(self, name, alias, acc, side, qty, price, client_code=None, ext_ref=None):
+        if name in self.__orders:
+            raise RuntimeError("order '{0}' already exists".format(name))
         instr = self.__instrdb.get_by_alias(alias)
         if not instr:
             raise RuntimeError("instrument not found by alias '{0}'".format(alias))
-        order = Order(self, name, self.__cback, instr, acc, client_code, side, qty, price, ext_ref)
+        if self.__simulator is not None:
+            order = self.__simulator.create_order(self, name, instr, acc, client_code, side, qty, price, ext_ref)
+        else:
+            order = Order(self, name, self.__cback, instr, acc, client_code, side, qty, price, ext_ref,
+                          self.__debug)
+            self.__registered[order.ptr] = order
         self.__orders[name] = order
+        orders = self.__by_instr.get(order.instr_id)
+        if orders is None:
+            self.__by_instr[order.instr_id] = {name: order}
+        else:
+            orders[name] = order
         return order
 
+    ##
+    # create orders of simulator instead of liborder ones, e.g. to run robot on replayed market data
+    # @param[in] simulator - @see ordersim.OrderSimulator, None to detach
+    def attach_simulator(self, simulator):
+        self.__simulator = simulator
+
+    ##
+    # pass sends, cancels and replaces of orders through scheduler, which keeps them under exchange message
+    # rate limits. It covers Order.send/cancel/replace as well as send_many, cancel_many, mass_cancel and
+    # replace_order
+    # @param[in] scheduler - @see OutboundScheduler, None to detach
+    def attach_scheduler(self, scheduler):
+        self.__scheduler = scheduler
+
+    ##
+    # attached scheduler or None, used by orders
+    @property
+    def _scheduler(self):
+        return self.__scheduler
+
+    ##
+    # forget destroyed order, called by simulator
+    # @param[in] name - order name
+    def _remove_order(self, name):
+        order = self.__orders.pop(name, None)
+        self.__replaces.pop(name, None)
+        if order is not None:
+            orders = self.__by_instr[order.instr_id]
+            del orders[name]
+            if not orders:
+                del self.__by_instr[order.instr_id]
+
+    ##
+    # replace order. In coalesce mode replace of order, which awaits replace, is kept till the pending one is
+    # done, and later replaces overwrite it, so only the latest qty and price are sent
+    # @param[in] order   - order to replace
+    # @param[in] qty     - new order qty
+    # @param[in] price   - new order price
+    # @param[in] ext_ref - order ext_ref
+    def replace_order(self, order, qty=None, price=None, ext_ref=None):
+        self.__replace_stat["requested"] += 1
+        if self.__coalesce and order.state == State.awaiting_replace:
+            pending = self.__replaces.get(order.name)
+            if pending is None:
+                self.__replaces[order.name] = [qty, price, ext_ref]
+            else:
+                if qty is not None:
+                    pending[0] = qty
+                if price is not None:
+                    pending[1] = price
+                if ext_ref is not None:
+                    pending[2] = ext_ref
+            return
+        self.__replace_stat["sent"] += 1
+        if self.__scheduler is not None:
+            res = self.__scheduler.replace(order, qty, price, ext_ref)
+            if res != Errno.ok:
+                raise RuntimeError("unable to replace order. error = {0}".format(Errno(res).name))
+        else:
+            order.replace(qty, price, ext_ref)
+
+    ##
+    # send coalesced replace of order, called when its pending replace is done or rejected
+    # @param[in] order - order
+    def _on_replace_done(self, order):
+        if not self.__replaces:
+            return
+        pending = self.__replaces.pop(order.name, None)
+        if pending is None or order.state != State.active:
+            return
+        qty, price, ext_ref = pending
+        if qty == order.qty:
+            qty = None
+        if price == order.price:
+            price = None
+        if qty is None and price is None and ext_ref is None:
+            return
+        self.__replace_stat["sent"] += 1
+        if self.__scheduler is not None:
+            res = self.__scheduler.replace(order, qty, price, ext_ref)
+        else:
+            res = order._replace(qty, price, ext_ref)
+        if res != Errno.ok:
+            logging.error("unable to replace order {0}. error = {1}".format(order.name, Errno(res).name))
+
+    ##
+    # statistic of replace_order
+    # @return dict with counts of requested and sent replaces, replaces saved by coalescing and pending ones
+    @property
+    def replace_statistic(self):
+        stat = self.__replace_stat
+        return {"requested": stat["requested"],
+                "sent": stat["sent"],
+                "saved": stat["requested"] - stat["sent"] - len(self.__replaces),
+                "pending": len(self.__replaces)}
+
     ##
     # process node incoming objects
     # @param[in] obj - object to process
@@ -297,23 +561,103 @@ class OrderPool(object):
         else:
             return self.__orders[name]
 
+    ##
+    # select orders by attributes. Orders are taken from index by instrument, other attributes are read
+    # from order snapshots, so liborder is not called
+    # @param[in] alias - instrument alias, any if None
+    # @param[in] side  - order side @see xtypes.Side, any if None
+    # @param[in] acc   - account, any if None
+    # @param[in] state - State or collection of states, any if None
+    # @return list of orders
+    def find_orders(self, alias=None, side=None, acc=None, state=None):
+        if alias is None:
+            orders = self.__orders.values()
+        else:
+            instr = self.__instrdb.get_by_alias(alias)
+            if not instr:
+                raise RuntimeError("instrument not found by alias '{0}'".format(alias))
+            orders = self.__by_instr.get(instr.id, {}).values()
+        if isinstance(state, State):
+            state = (state,)
+        return [o for o in orders
+                if (side is None or o.side == side) and
+                   (acc is None or o.acc == acc) and
+                   (state is None or o.state in state)]
+
+    ##
+    # send orders, failure of order does not stop sending of others
+    # @param[in] orders - orders to send, all orders if None
+    # @return dict {order name: Errno} of failed orders
+    def send_many(self, orders=None):
+        failed = dict()
+        scheduler = self.__scheduler
+        for o in list(self.__orders.values()) if orders is None else orders:
+            res = o._send() if scheduler is None else scheduler.send(o)
+            if res != Errno.ok:
+                failed[o.name] = Errno(res)
+        return failed
+
+    ##
+    # cancel active orders, failure of order does not stop canceling of others.
+    # with scheduler queued sends and replaces of orders are dropped too @see OutboundScheduler.cancel
+    # @param[in] orders - orders to cancel, all orders if None
+    # @return dict {order name: Errno} of failed orders
+    def cancel_many(self, orders=None):
+        failed = dict()
+        scheduler = self.__scheduler
+        for o in list(self.__orders.values()) if orders is None else orders:
+            if scheduler is not None:
+                res = scheduler.cancel(o)
+            elif o.is_active:
+                res = o._cancel()
+            else:
+                continue
+            if res != Errno.ok:
+                failed[o.name] = Errno(res)
+        return failed
+
+    ##
+    # destroy orders, failure of order does not stop destroying of others
+    # @param[in] orders - orders to destroy, all orders if None
+    # @param[in] force  - destroy without cancel
+    # @return dict {order name: Errno} of failed orders
+    def destroy_many(self, orders=None, force=False):
+        failed = dict()
+        for o in list(self.__orders.values()) if orders is None else orders:
+            res = o._destroy(force)
+            if res != Errno.ok:
+                failed[o.name] = Errno(res)
+        return failed
+
+    ##
+    # cancel active orders selected by attributes, e.g. pull all quotes of instrument
+    # @see find_orders, cancel_many
+    # @return dict {order name: Errno} of failed orders
+    def mass_cancel(self, alias=None, side=None, acc=None, state=None):
+        return self.cancel_many(self.find_orders(alias, side, acc, state))
+
     ##
     # send all orders
+    # @exception RuntimeError - some orders are not sent, the rest are sent anyway
     def send(self):
-        for k, o in self.__orders.items():
-            o.send()
+        failed = self.send_many()
+        if failed:
+            raise RuntimeError("unable to send orders {0}".format(
+                ", ".join("{0} ({1})".format(k, v.name) for k, v in failed.items())))
 
     ##
     # cancel all orders
+    # @exception RuntimeError - some orders are not canceled, the rest are canceled anyway
     def cancel(self):
-        for k, o in self.__orders.items():
-            o.cancel()
+        failed = self.cancel_many()
+        if failed:
+            raise RuntimeError("unable to cancel orders {0}".format(
+                ", ".join("{0} ({1})".format(k, v.name) for k, v in failed.items())))
 
     ##
     # destroy all orders
     def destroy(self, force=False):
-        for k, o in list(self.__orders.items()):
-            o.destroy(force)
+        self.destroy_many(force=force)
 
     def on_before_send(self, order):
         pass
@@ -348,4 +692,287 @@ class OrderPool(object):
     def on_order_replace_rejected(self, order, err_code, err_txt):
         pass
 
+
+##
+# @class token bucket of message rate limit
+class TokenBucket(object):
+
+    ##
+    # @param[in] rate  - messages per second
+    # @param[in] burst - max count of messages sent at once, rate if None
+    # @param[in] now   - current time, ns
+    def __init__(self, rate, burst=None, now=0):
+        self.__rate = rate / 1e9
+        self.__burst = rate if burst is None else burst
+        self.__tokens = self.__burst
+        self.__ts = now
+
+    ##
+    # take token if any
+    # @param[in] now - current time, ns
+    # @return True if token is taken
+    def take(self, now):
+        tokens = min(self.__burst, self.__tokens + (now - self.__ts) * self.__rate)
+        self.__ts = now
+        if tokens >= 1:
+            self.__tokens = tokens - 1
+            return True
+        self.__tokens = tokens
+        return False
+
+    ##
+    # time till next token
+    # @param[in] now - current time, ns
+    # @return ns
+    def wait_time(self, now):
+        tokens = self.__tokens + (now - self.__ts) * self.__rate
+        return 0 if tokens >= 1 else int((1 - tokens) / self.__rate) + 1
+
+
+##
+# @class outbound scheduler, which keeps order actions under exchange message rate limits.
+# Each account (or other key of order) has token bucket. Action is sent at once, if bucket has token and
+# nothing is queued, else it is queued and sent by priority: cancels, then replaces, then new orders.
+# Queued replaces of order are merged into one, so are queued cancels. Replace of order, which send is queued,
+# is held till the send is sent, so actions of one order keep request order. Queues are drained by timer in node
+# loop, or by drain()
+class OutboundScheduler(object):
+
+    ##
+    # @param[in] rate  - default limit of key, messages per second. None is unlimited
+    # @param[in] burst - default burst of key, rate if None
+    # @param[in] key   - callable(order) -> key of limit, account by default. e.g. session of account
+    # @param[in] timer - drain queues by timer, else drain() should be called by user, e.g. in replay
+    # @param[in] clock - current time, ns
+    def __init__(self, rate=None, burst=None, key=None, timer=True, clock=time.monotonic_ns):
+        self.__default = (rate, burst)
+        self.__limits = dict()    # key -> (rate, burst)
+        self.__buckets = dict()   # key -> TokenBucket or None if unlimited
+        self.__queues = dict()    # key -> deques of [ts, action, order, args] by Priority
+        self.__sends = dict()     # order -> queued send entry, its args are held replace or None
+        self.__replaces = dict()  # order -> queued replace entry
+        self.__cancels = dict()   # order -> queued cancel entry
+        self.__key = key if key is not None else (lambda order: order.acc)
+        self.__clock = clock
+        self.__timer = Timer(self.__on_timer) if timer else None
+        self.__timer_armed = False
+        self.__depth = 0
+        self.__stat = dict.fromkeys(("sent", "queued", "coalesced", "skipped", "dropped", "failed", "max_depth",
+                                     "wait_total", "wait_max"), 0)
+
+    ##
+    # set limit of key
+    # @param[in] key   - key of limit, e.g. account
+    # @param[in] rate  - messages per second. None is unlimited
+    # @param[in] burst - max count of messages sent at once, rate if None
+    def set_limit(self, key, rate, burst=None):
+        self.__limits[key] = (rate, burst)
+        self.__buckets.pop(key, None)
+
+    ##
+    # count of queued actions
+    def __len__(self):
+        return self.__depth
+
+    ##
+    # send new order
+    # @return Errno of liborder if order is sent at once, Errno.ok if it is queued
+    def send(self, order):
+        return self.__submit(Priority.new, order, None)
+
+    ##
+    # cancel order. queued send and replace of order are dropped, cancel is sent only if order is active
+    # and has no queued cancel
+    # @return Errno of liborder if cancel is sent at once, Errno.ok if it is queued or not needed
+    def cancel(self, order):
+        self.__drop(self.__sends, order)
+        self.__drop(self.__replaces, order)
+        if order in self.__cancels:
+            self.__stat["coalesced"] += 1
+            return Errno.ok
+        if not order.is_active:
+            self.__stat["skipped"] += 1
+            return Errno.ok
+        return self.__submit(Priority.cancel, order, None)
+
+    ##
+    # drop queued action of order. entry stays in queue till drain skips it
+    # @param[in] entries - entries of action by order, e.g. queued sends
+    def __drop(self, entries, order):
+        entry = entries.pop(order, None)
+        if entry is not None:
+            entry[1] = None
+            self.__depth -= 1
+            self.__stat["dropped"] += 1
+
+    ##
+    # replace order
+    # @return Errno of liborder if replace is sent at once, Errno.ok if it is queued, held till queued send
+    #         of order is sent or merged with queued one
+    def replace(self, order, qty=None, price=None, ext_ref=None):
+        entry = self.__replaces.get(order)
+        if entry is None:
+            entry = self.__sends.get(order)
+            if entry is not None and entry[3] is None:
+                entry[3] = (qty, price, ext_ref)
+                return Errno.ok
+        if entry is not None:
+            args = entry[3]
+            entry[3] = (args[0] if qty is None else qty,
+                        args[1] if price is None else price,
+                        args[2] if ext_ref is None else ext_ref)
+            self.__stat["coalesced"] += 1
+            return Errno.ok
+        return self.__submit(Priority.replace, order, (qty, price, ext_ref))
+
+    def __submit(self, action, order, args):
+        key = self.__key(order)
+        now = self.__clock()
+        queues = self.__queues.get(key)
+        if queues is None and self.__bucket(key, now).take(now):
+            return self.__execute(action, order, args)
+        if queues is None:
+            queues = self.__queues[key] = (deque(), deque(), deque())
+        self.__enqueue(queues, now, action, order, args)
+        self.__drain_key(key, queues, now)
+        self.__arm(now)
+        return Errno.ok
+
+    def __enqueue(self, queues, now, action, order, args):
+        entry = [now, action, order, args]
+        queues[action].append(entry)
+        if action == Priority.replace:
+            self.__replaces[order] = entry
+        elif action == Priority.new:
+            self.__sends[order] = entry
+        else:
+            self.__cancels[order] = entry
+        self.__depth += 1
+        self.__stat["queued"] += 1
+        if self.__depth > self.__stat["max_depth"]:
+            self.__stat["max_depth"] = self.__depth
+
+    def __bucket(self, key, now):
+        if key not in self.__buckets:
+            rate, burst = self.__limits.get(key, self.__default)
+            self.__buckets[key] = _unlimited if rate is None else TokenBucket(rate, burst, now)
+        return self.__buckets[key]
+
+    def __execute(self, action, order, args):
+        if action == Priority.new:
+            res = order._send()
+        elif action == Priority.cancel:
+            self.__drop(self.__replaces, order)
+            res = order._cancel()
+        else:
+            res = order._replace(*args)
+        self.__stat["sent"] += 1
+        if res != Errno.ok:
+            self.__stat["failed"] += 1
+            logging.error("unable to {0} order {1}. error = {2}".format(Priority(action).name, order.name,
+                                                                        Errno(res).name))
+        return res
+
+    ##
+    # send queued actions, which are allowed by limits
+    # @return count of sent actions
+    def drain(self):
+        now = self.__clock()
+        cnt = 0
+        for key, queues in list(self.__queues.items()):
+            cnt += self.__drain_key(key, queues, now)
+        self.__arm(now)
+        return cnt
+
+    def __drain_key(self, key, queues, now):
+        bucket = self.__bucket(key, now)
+        stat = self.__stat
+        cnt = 0
+        for queue in queues:
+            while queue:
+                if queue[0][1] is None:  # dropped
+                    queue.popleft()
+                    continue
+                if not bucket.take(now):
+                    break
+                ts, action, order, args = queue.popleft()
+                self.__depth -= 1
+                if action == Priority.replace:
+                    del self.__replaces[order]
+                elif action == Priority.new:
+                    del self.__sends[order]
+                else:
+                    del self.__cancels[order]
+                wait = now - ts
+                stat["wait_total"] += wait
+                if wait > stat["wait_max"]:
+                    stat["wait_max"] = wait
+                if action == Priority.cancel and not order.is_active:
+                    stat["skipped"] += 1
+                    continue
+                if action != Priority.new:
+                    self.__execute(action, order, args)
+                elif self.__execute(action, order, None) == Errno.ok and args is not None:
+                    # held replace follows its send, it is queued if bucket has no token for it
+                    if bucket.take(now):
+                        self.__execute(Priority.replace, order, args)
+                        cnt += 1
+                    else:
+                        self.__enqueue(queues, now, Priority.replace, order, args)
+                cnt += 1
+        if not any(queues):
+            del self.__queues[key]
+        return cnt
+
+    ##
+    # time till next queued action is allowed by limits
+    # @return ns or None if nothing is queued
+    def next_time(self, now=None):
+        if not self.__queues:
+            return None
+        if now is None:
+            now = self.__clock()
+        return min(self.__bucket(key, now).wait_time(now) for key in self.__queues)
+
+    def __arm(self, now):
+        if self.__timer is None or self.__timer_armed:
+            return
+        wait = self.next_time(now)
+        if wait is not None:
+            self.__timer_armed = True
+            self.__timer.start(max(1, wait // 1000))
+
+    def __on_timer(self, timer):
+        self.__timer_armed = False
+        self.drain()
+
+    ##
+    # scheduler statistic
+    # @return dict with counts of sent, queued, merged replaces and cancels, skipped cancels of inactive orders,
+    #         queued actions dropped by cancel, failed actions, current and max queue depth, avg and max wait time
+    #         in queue, ns
+    @property
+    def statistic(self):
+        stat = dict(self.__stat)
+        dequeued = stat["queued"] - self.__depth - stat["dropped"]
+        stat["depth"] = self.__depth
+        stat["wait_avg"] = stat.pop("wait_total") / dequeued if dequeued else 0
+        return stat
+
+
+##
+# bucket of key without limit
+class _Unlimited(object):
+
+    @staticmethod
+    def take(now):
+        return True
+
+    @staticmethod
+    def wait_time(now):
+        return 0
+
+
+_unlimited = _Unlimited()
+
 # vim:et:sts=4:sw=4
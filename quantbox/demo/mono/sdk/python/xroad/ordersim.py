@@ -0,0 +1,455 @@
+##
+# @file ordersim.py
+# local stand-in of liborder for offline tests: orders of OrderPool are matched against market data books
+# and exchange responses come back through OrderPool callbacks after latency given by pluggable model
+
+import heapq
+import random
+import time
+from xroad.order import State, _active_states
+from xroad.mdata import SideType
+from xroad.xtypes import Side, RejReason, Errno
+
+##
+# @class latency model with the same latency of all actions
+class FixedLatency(object):
+
+    ##
+    # @param[in] latency - latency, ns
+    def __init__(self, latency):
+        self.__latency = latency
+
+    ##
+    # @param[in] order  - @see SimOrder
+    # @param[in] action - "send", "cancel" or "replace"
+    # @return latency of response, ns
+    def __call__(self, order, action):
+        return self.__latency
+
+
+##
+# @class latency model with latency uniformly distributed in range
+class UniformLatency(object):
+
+    ##
+    # @param[in] low  - min latency, ns
+    # @param[in] high - max latency, ns
+    # @param[in] seed - seed of random generator, replays are repeatable with the same seed
+    def __init__(self, low, high, seed=None):
+        self.__low = low
+        self.__span = high - low + 1
+        self.__random = random.Random(seed).random  # randint is several times slower
+
+    def __call__(self, order, action):
+        return self.__low + int(self.__random() * self.__span)
+
+
+##
+# @class simulated order, has the same interface as order.Order
+class SimOrder(object):
+
+    __slots__ = ("_pool", "_sim", "_name", "_instr", "_instr_id", "_acc", "_client_code", "_side", "_qty",
+                 "_price", "_ext_ref", "_state", "_total_qty", "_avg_price", "_live", "_destroying", "_gen",
+                 "_due")
+
+    def __init__(self, pool, sim, name, instr, acc, client_code, side, qty, price, ext_ref):
+        self._pool = pool
+        self._sim = sim
+        self._name = name
+        self._instr = instr
+        self._instr_id = instr.id
+        self._acc = acc
+        self._client_code = client_code
+        self._side = side
+        self._qty = qty
+        self._price = price
+        self._ext_ref = ext_ref
+        self._state = State.initial
+        self._total_qty = 0
+        self._avg_price = 0.0
+        self._live = False         # order is on simulated exchange
+        self._destroying = False   # order is destroyed after cancel
+        self._gen = 0              # incremented on replace, entries of book with old generation are dropped
+        self._due = 0              # time of last scheduled response, responses of order keep request order
+
+    ##
+    # options are ignored by simulator
+    def set_option(self, opt, val):
+        pass
+
+    def __str__(self):
+        return "name={0}, instr={1}, side={2}, qty={3}, price={4}, state={5}, total_qty={6}, avg_price={7}".format(
+            self._name, self._instr_id, Side(self._side).name, self._qty, self._price, self._state.name,
+            self._total_qty, self._avg_price)
+
+    ##
+    # checks if order is active
+    @property
+    def is_active(self):
+        return self._state in _active_states
+
+    ##
+    # delete order
+    # @param[in] force - destroy order without cancel
+    def destroy(self, force=False):
+        self._destroy(force)
+
+    def _destroy(self, force=False):
+        self._sim._destroy(self, force)
+        return Errno.ok
+
+    ##
+    # send order to simulated exchange, through scheduler of pool if it is attached
+    def send(self):
+        scheduler = self._pool._scheduler
+        if (self._send() if scheduler is None else scheduler.send(self)) != Errno.ok:
+            raise RuntimeError("unable to send order")
+
+    def _send(self):
+        if self._state != State.initial:
+            return Errno.wrong_state
+        self._sim._send(self)
+        return Errno.ok
+
+    ##
+    # cancel order on simulated exchange, through scheduler of pool if it is attached
+    def cancel(self):
+        scheduler = self._pool._scheduler
+        if scheduler is not None:
+            scheduler.cancel(self)
+        elif self.is_active:
+            self._cancel()
+
+    def _cancel(self):
+        self._sim._cancel(self)
+        return Errno.ok
+
+    ##
+    # replace order
+    # @param[in] qty - new order qty
+    # @param[in] price - new order price
+    # @param[in] ext_ref - order ext_ref
+    def replace(self, qty=None, price=None, ext_ref=None):
+        scheduler = self._pool._scheduler
+        if scheduler is not None:
+            scheduler.replace(self, qty, price, ext_ref)
+        else:
+            self._replace(qty, price, ext_ref)
+
+    def _replace(self, qty=None, price=None, ext_ref=None):
+        if qty is not None or price is not None or ext_ref is not None:
+            self._sim._replace(self, qty, price, ext_ref)
+        return Errno.ok
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def instr(self):
+        return self._instr
+
+    @property
+    def instr_id(self):
+        return self._instr_id
+
+    @property
+    def side(self):
+        return self._side
+
+    @property
+    def acc(self):
+        return self._acc
+
+    @property
+    def qty(self):
+        return self._qty
+
+    @property
+    def leaves_qty(self):
+        return self._qty - self._total_qty if self._live else 0
+
+    @property
+    def price(self):
+        return self._price
+
+    @property
+    def total_qty(self):
+        return self._total_qty
+
+    @property
+    def avg_price(self):
+        return self._avg_price
+
+    ##
+    # simulated orders have no xroad_order
+    @property
+    def xorder(self):
+        return None
+
+
+##
+# @class simulated exchange for OrderPool. Attach it by OrderPool.attach_simulator, feed it with books by on_book
+# and call poll to deliver responses, which are due. @see replay.Replay does both.
+# New orders and replaces take liquidity of the last book at its levels, rest of order is placed into
+# queue of instrument and is filled at its price, when later book crosses it. Replaced order loses its
+# time priority. Liquidity taken from book is not available for other orders till next book of instrument.
+class OrderSimulator(object):
+
+    ##
+    # @param[in] latency - latency model, callable(order, action) -> ns, or latency of all actions, ns
+    # @param[in] check   - callable(order) -> None or (RejReason, text) to reject new orders, e.g. risk checks
+    def __init__(self, latency=0, check=None):
+        self.__latency = latency if callable(latency) else FixedLatency(latency)
+        self.__check = check
+        self.__now = 0
+        self.__seq = 0
+        self.__events = []    # heap of (due, seq, handler, order, args)
+        self.__books = dict()     # instr_id -> [book, asks, bids], levels are taken from book on first match
+        self.__resting = dict()   # instr_id -> (bids, asks) heaps of (priority, seq, gen, order)
+        self.__stat = dict.fromkeys(("orders", "events", "trades", "activated", "rejected", "canceled",
+                                     "cancel_rejected", "replaced", "replace_rejected"), 0)
+
+    ##
+    # current simulated time, ns
+    @property
+    def now(self):
+        return self.__now
+
+    ##
+    # count of responses, which are not delivered yet
+    def __len__(self):
+        return len(self.__events)
+
+    ##
+    # create order, called by OrderPool.create_order
+    # @return @see SimOrder
+    def create_order(self, pool, name, instr, acc, client_code, side, qty, price, ext_ref):
+        self.__stat["orders"] += 1
+        return SimOrder(pool, self, name, instr, acc, client_code, side, qty, price, ext_ref)
+
+    ##
+    # deliver responses due by time
+    # @param[in] now - simulated time, ns. monotonic clock if None
+    # @return count of delivered responses
+    def poll(self, now=None):
+        if now is None:
+            now = time.monotonic_ns()
+        events = self.__events
+        cnt = 0
+        while events and events[0][0] <= now:
+            due, _, handler, order, args = heapq.heappop(events)
+            if due > self.__now:
+                self.__now = due
+            handler(order, args)
+            cnt += 1
+        if now > self.__now:
+            self.__now = now
+        self.__stat["events"] += cnt
+        return cnt
+
+    ##
+    # update book of instrument and fill resting orders, which are crossed by it
+    # @param[in] book - @see mdata.Book, it is copied
+    def on_book(self, book):
+        instr_id = book.instr_id
+        self.__books[instr_id] = [book.copy(), None, None]
+        resting = self.__resting.get(instr_id)
+        if resting is not None:
+            self.__match_resting(instr_id, resting[0], SideType.Ask)
+            self.__match_resting(instr_id, resting[1], SideType.Bid)
+
+    ##
+    # simulator statistic
+    # @return dict with counts of orders, delivered responses, trades and responses of each kind
+    @property
+    def statistic(self):
+        res = dict(self.__stat)
+        res["pending"] = len(self.__events)
+        return res
+
+    def __schedule(self, order, action, handler, args=None):
+        due = max(self.__now + self.__latency(order, action), order._due)
+        order._due = due
+        self.__seq += 1
+        heapq.heappush(self.__events, (due, self.__seq, handler, order, args))
+
+    def _send(self, order):
+        order._pool.on_before_send(order)
+        order._state = State.awaiting_active
+        self.__schedule(order, "send", self.__on_new)
+
+    def _cancel(self, order):
+        if order._state != State.awaiting_destroy:
+            order._state = State.awaiting_cancel
+        self.__schedule(order, "cancel", self.__on_cancel)
+
+    def _replace(self, order, qty, price, ext_ref):
+        pending = order._state == State.awaiting_replace
+        if order._state == State.active or order._state == State.awaiting_active:
+            order._state = State.awaiting_replace
+        self.__schedule(order, "replace", self.__on_replace, (qty, price, ext_ref, pending))
+
+    def _destroy(self, order, force):
+        if order._live and not force:
+            order._destroying = True
+            order._state = State.awaiting_destroy
+            self.__schedule(order, "cancel", self.__on_cancel)
+        else:
+            self.__destroyed(order)
+
+    def __destroyed(self, order):
+        order._live = False
+        order._state = State.destroyed
+        order._pool.on_order_destroyed(order)
+        order._pool._remove_order(order._name)
+
+    def __on_new(self, order, _):
+        if order._state == State.destroyed:
+            return
+        reason = None
+        if order._qty <= 0:
+            reason = (RejReason.other, "wrong qty {0}".format(order._qty))
+        elif order._side != Side.buy and order._side != Side.sell:
+            reason = (RejReason.other, "wrong side {0}".format(order._side))
+        elif self.__check is not None:
+            reason = self.__check(order)
+        if reason is not None:
+            order._state = State.rejected
+            self.__stat["rejected"] += 1
+            order._pool.on_order_rejected(order, reason[0], reason[1])
+            return
+        order._live = True
+        if order._state == State.awaiting_active:
+            order._state = State.active
+        self.__stat["activated"] += 1
+        order._pool.on_order_activate(order)
+        self.__execute(order)
+
+    def __on_cancel(self, order, _):
+        if order._live:
+            order._live = False
+            if order._state == State.awaiting_cancel:
+                order._state = State.canceled
+            self.__stat["canceled"] += 1
+            order._pool.on_order_canceled(order)
+        elif order._state != State.destroyed:
+            self.__stat["cancel_rejected"] += 1
+            order._pool.on_order_cancel_rejected(order, RejReason.too_late, "order is not active")
+        if order._destroying and order._state != State.destroyed:
+            self.__destroyed(order)
+
+    def __on_replace(self, order, args):
+        qty, price, ext_ref, pending = args
+        if pending:
+            reason = (RejReason.already_in_pending, "replace is in progress")
+        elif not order._live:
+            reason = (RejReason.too_late, "order is not active")
+        elif qty is not None and qty <= order._total_qty:
+            reason = (RejReason.other, "qty {0} is not above filled qty {1}".format(qty, order._total_qty))
+        else:
+            reason = None
+        if reason is not None:
+            if not pending and order._live and order._state == State.awaiting_replace:
+                order._state = State.active
+            self.__stat["replace_rejected"] += 1
+            order._pool._on_replace_done(order)
+            order._pool.on_order_replace_rejected(order, reason[0], reason[1])
+            return
+        if qty is not None:
+            order._qty = qty
+        if price is not None:
+            order._price = price
+        if ext_ref is not None:
+            order._ext_ref = ext_ref
+        order._gen += 1
+        if order._state == State.awaiting_replace:
+            order._state = State.active
+        self.__stat["replaced"] += 1
+        order._pool._on_replace_done(order)
+        order._pool.on_order_replaced(order)
+        if order._live:
+            self.__execute(order)
+
+    ##
+    # take liquidity of last book by new or replaced order, then place its rest into queue
+    def __execute(self, order):
+        buy = order._side == Side.buy
+        levels = self.__levels(order._instr_id, SideType.Ask if buy else SideType.Bid)
+        if levels:
+            self.__fill(order, levels, False)
+        if order._live:
+            resting = self.__resting.get(order._instr_id)
+            if resting is None:
+                resting = self.__resting[order._instr_id] = ([], [])
+            self.__seq += 1
+            if buy:
+                heapq.heappush(resting[0], (-order._price, self.__seq, order._gen, order))
+            else:
+                heapq.heappush(resting[1], (order._price, self.__seq, order._gen, order))
+
+    ##
+    # fill resting orders of one side by price-time priority
+    # @param[in] queue - heap of resting orders
+    # @param[in] side  - side of book, which fills orders
+    def __match_resting(self, instr_id, queue, side):
+        while queue:
+            _, _, gen, order = queue[0]
+            if not order._live or order._gen != gen:
+                heapq.heappop(queue)
+                continue
+            levels = self.__levels(instr_id, side)
+            if not levels or not self.__fill(order, levels, True):
+                return
+            if not order._live:
+                heapq.heappop(queue)
+
+    ##
+    # gets levels of last book, which are left after previous fills
+    def __levels(self, instr_id, side):
+        book = self.__books.get(instr_id)
+        if book is None:
+            return None
+        n = 1 if side == SideType.Ask else 2
+        if book[n] is None:
+            book[n] = book[0].get_levels(side)
+        return book[n]
+
+    ##
+    # fill order by levels, which cross its price
+    # @param[in] passive - order is resting and is filled at its price, else at prices of levels
+    # @return filled qty
+    def __fill(self, order, levels, passive):
+        buy = order._side == Side.buy
+        limit = order._price
+        filled = 0
+        for level in levels:
+            price, avail = level
+            if avail <= 0:
+                continue
+            if price > limit if buy else price < limit:
+                break
+            qty = min(avail, order._qty - order._total_qty)
+            level[1] = avail - qty
+            filled += qty
+            self.__trade(order, qty, limit if passive else price)
+            if not order._live:
+                break
+        return filled
+
+    def __trade(self, order, qty, price):
+        total = order._total_qty + qty
+        order._avg_price = (order._avg_price * order._total_qty + price * qty) / total
+        order._total_qty = total
+        if total >= order._qty:
+            order._live = False
+            if order._state != State.awaiting_destroy:
+                order._state = State.filled
+        self.__stat["trades"] += 1
+        order._pool.on_order_trade(order, qty, price)
+
+# vim:et:sts=4:sw=4
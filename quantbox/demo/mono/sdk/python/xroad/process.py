@@ -37,7 +37,7 @@ class Process(Node):
             self.__state = False
             self.shutdown()
         elif sig == signal.SIGHUP:
-            Node.reconfigure(self)
+            self.reconfigure()
             self.reconfig()
 
     ##
@@ -62,7 +62,7 @@ class Process(Node):
             self.data.statistic.reset()
             self.reset(obj.hint)
         elif obj.object_type == objects.ObjectType.reconfig:
-            Node.reconfigure(self)
+            self.reconfigure()
             self.reconfig()
         else:
             self.on_object(obj, node_id)
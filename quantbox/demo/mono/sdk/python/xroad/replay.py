@@ -0,0 +1,125 @@
+##
+# @file replay.py
+# replay of market data journal into MarketData (e.g. Robot) callbacks, without mdata engine
+
+import ctypes
+import time
+from xroad import mdata_ctypes
+from xroad.journal import JournalReader
+from xroad.mdata import ProtoType, Book
+
+# proto type -> size of market data, records are copied into writable buffer of max size before dispatch
+_data_sizes = {ProtoType.book: ctypes.sizeof(mdata_ctypes.Book_20CTypes),
+               ProtoType.quote: ctypes.sizeof(mdata_ctypes.QuoteCTypes),
+               ProtoType.trade: ctypes.sizeof(mdata_ctypes.TradeCTypes),
+               ProtoType.common_info: ctypes.sizeof(mdata_ctypes.CommonInfoCTypes)}
+
+
+##
+# @class replays journal records through MarketData.process_mdata, so they reach the same
+# on_mdata_* callbacks and handlers as live market data
+class Replay(object):
+
+    ##
+    # @param[in] journal - path to journal or @see journal.JournalReader
+    # @param[in] mdata   - @see MarketData, e.g. Robot
+    # @param[in] speed   - None replays at max speed, else wall-clock is scaled by speed, e.g. 10 is 10x faster
+    # @param[in] cycle   - count of records, after which conflated and batched market data is delivered,
+    #                      as after one receive cycle of live node
+    # @param[in] simulator - @see ordersim.OrderSimulator attached to OrderPool of mdata. it gets books of journal
+    #                        and delivers order responses by receive time of records
+    def __init__(self, journal, mdata, speed=None, cycle=1, simulator=None):
+        self.__reader = journal if isinstance(journal, JournalReader) else JournalReader(journal)
+        self.__mdata = mdata
+        self.__speed = speed
+        self.__cycle = cycle
+        self.__simulator = simulator
+        # journal is mapped read-only, handlers get copy of record, which they may change as live market data
+        self.__scratch = ctypes.create_string_buffer(max(_data_sizes.values()))
+        self.__book = Book(None, ctypes.pointer(mdata_ctypes.Book_20CTypes()))  # rebound to scratch buffer
+        self.__ticks = 0
+        self.__elapsed = 0
+        self.__hist = [0] * 64  # bucket n counts latencies in [2^(n-1), 2^n) ns
+
+    ##
+    # replay records
+    # @param[in] instr_id - replay only records of instrument, all if None
+    # @param[in] start    - min receive timestamp of time.monotonic_ns(), ns, @see JournalReader.find
+    # @param[in] stop     - receive timestamp of time.monotonic_ns() to stop at, ns
+    # @return count of replayed records
+    def run(self, instr_id=None, start=None, stop=None):
+        reader = self.__reader
+        reader.refresh()
+        index = reader.find(instr_id, start, stop)
+        if not len(index):
+            return 0
+        recs = reader.records
+        rcv_ts = recs["rcv_ts"][index].tolist()
+        md_types = recs["md_type"][index].tolist()
+        base = reader.address(0)
+        size = reader.record_size
+        scratch = ctypes.addressof(self.__scratch)
+        data_sizes = [_data_sizes[md_type] for md_type in md_types]
+        process = self.__mdata.process_mdata
+        deliver_conflated = self.__mdata.deliver_conflated
+        deliver_batch = self.__mdata.deliver_batch
+        hist = self.__hist
+        clock = time.perf_counter_ns
+        speed = self.__speed
+        cycle = self.__cycle
+        simulator = self.__simulator
+        book = self.__book
+        first_ts = rcv_ts[0]
+        begin = clock()
+        for n, pos in enumerate(index.tolist()):
+            if speed is not None:
+                delay = (rcv_ts[n] - first_ts) / speed - (clock() - begin)
+                if delay > 0:
+                    time.sleep(delay / 1e9)
+            t0 = clock()
+            ctypes.memmove(scratch, base + pos * size, data_sizes[n])
+            if simulator is not None:
+                simulator.poll(rcv_ts[n])
+                if md_types[n] == ProtoType.book:
+                    book._reset(scratch)
+                    simulator.on_book(book)
+            process(md_types[n], scratch)
+            if (n + 1) % cycle == 0:
+                deliver_conflated()
+                deliver_batch()
+            hist[(clock() - t0).bit_length()] += 1
+        deliver_conflated()
+        deliver_batch()
+        self.__elapsed += clock() - begin
+        self.__ticks += len(index)
+        return len(index)
+
+    ##
+    # replay statistic
+    # @return dict with count of ticks, elapsed seconds, ticks per second, callback latency percentiles, ns,
+    #         and latency histogram {upper bound of bucket, ns: count}
+    @property
+    def statistic(self):
+        elapsed = self.__elapsed / 1e9
+        return {"ticks": self.__ticks,
+                "elapsed": elapsed,
+                "rate": self.__ticks / elapsed if elapsed else 0,
+                "p50": self.__percentile(0.5),
+                "p99": self.__percentile(0.99),
+                "max": self.__percentile(1.0),
+                "histogram": {1 << n: cnt for n, cnt in enumerate(self.__hist) if cnt}}
+
+    ##
+    # upper bound of latency bucket, which contains percentile
+    def __percentile(self, q):
+        total = sum(self.__hist)
+        if not total:
+            return 0
+        acc = 0
+        for n, cnt in enumerate(self.__hist):
+            acc += cnt
+            if acc >= q * total:
+                return 1 << n
+        return 1 << (len(self.__hist) - 1)
+
+# vim:et:sts=4:sw=4
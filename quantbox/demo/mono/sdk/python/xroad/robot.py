@@ -35,8 +35,20 @@ class Robot(Process, InstrDB, MarketData, OrderPool, Ui):
         if obj.object_type == objects.ObjectType.field:
             self.on_node_field(FieldWrapper(obj), node_id)
         else:
+            if obj.object_type == objects.ObjectType.instr:
+                InstrDB.on_instr_update(self, obj)
             OrderPool.process_node_object(self, obj, node_id)
 
+    def receive(self):
+        Process.receive(self)
+        MarketData.deliver_conflated(self)
+        MarketData.deliver_batch(self)
+
+    def reconfigure(self):
+        Process.reconfigure(self)
+        InstrDB.invalidate_instr_cache(self)
+        MarketData.reset_dispatch(self)
+
     def run(self):
         MarketData.start(self)
         self.data.status = NodeStatus.inactive